@@ -5,6 +5,8 @@ import shutil
 import subprocess
 
 import makemehappy.cmake as c
+import makemehappy.instancelog as il
+import makemehappy.result as result
 import makemehappy.utilities as mmh
 import makemehappy.zephyr as z
 
@@ -228,7 +230,10 @@ def cmakeConfigure(cfg, log, args, stats, ext, root, instance):
 
 def cmakeBuild(cfg, log, args, stats, instance):
     mmh.maybeShowPhase(log, 'compile', instanceName(instance), args)
-    rc = mmh.loggedProcess(cfg, log, c.compile())
+    live = result.liveIncidents(cfg, instanceName(instance), '.')
+    rc = mmh.loggedProcess(cfg, log, c.compile(), observer = live)
+    if (live is not None):
+        live.close(log)
     stats.logBuild(rc)
     return (rc == 0)
 
@@ -278,10 +283,14 @@ def build(cfg, log, args, stats, ext, root, instance):
     else:
         os.makedirs(dnamefull)
     os.chdir(dnamefull)
-    (cmakeConfigure(cfg, log, args, stats, ext, root, instance) and
-     cmakeBuild(cfg, log, args, stats, instance)                and
-     cmakeTest(cfg, log, args, stats, instance)                 and
-     maybeInstall(cfg, log, args, stats, instance))
+    # A build root, that is removed after the build, takes instance logs with
+    # it. Keep their contents in the main log in that case.
+    combine = (args.sub_command == 'build' and args.preserve == False)
+    with il.capture(cfg, log, root, dname, combine):
+        (cmakeConfigure(cfg, log, args, stats, ext, root, instance) and
+         cmakeBuild(cfg, log, args, stats, instance)                and
+         cmakeTest(cfg, log, args, stats, instance)                 and
+         maybeInstall(cfg, log, args, stats, instance))
     os.chdir(root)
 
 def listInstances(log, mod, args):
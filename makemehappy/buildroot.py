@@ -34,12 +34,14 @@ class BuildRoot:
 
         if (dirName == None):
             self.root = mkTempDir(seed, modName)
-        elif (os.path.exists(dirName)):
-            existing = True
-            self.root = dirName
         else:
+            # Another instance of mmh may create the same directory at the
+            # same time. Creating it is the test, so there is no race.
             self.root = dirName
-            os.mkdir(self.root, 0o755)
+            try:
+                os.mkdir(self.root, 0o755)
+            except FileExistsError:
+                existing = True
 
         if existing:
             self.log.info("Using build-directory: {}".format(self.root))
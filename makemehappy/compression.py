@@ -0,0 +1,175 @@
+import atexit
+import io
+import os
+import queue
+import threading
+
+# Log files are selected to be compressed by their file name extension. This
+# maps extensions to the names of supported compression formats.
+extensions = { '.gz':   'gzip',
+               '.z':    'gzip',
+               '.xz':   'xz',
+               '.lzma': 'xz',
+               '.bz2':  'bzip2',
+               '.zst':  'zstd',
+               '.zstd': 'zstd' }
+
+class MissingZstandard(Exception):
+    pass
+
+def compressionFormat(fn):
+    for ext in extensions:
+        if fn.endswith(ext):
+            return extensions[ext]
+    return None
+
+def plainName(fn):
+    # The name of a file, without the extension of a compression format.
+    name = os.path.basename(fn)
+    if compressionFormat(name) is not None:
+        name = os.path.splitext(name)[0]
+    return name
+
+# The modules implementing the formats are imported when a file of that format
+# is opened. Most runs of mmh never touch compressed files.
+
+def requireZstandard(fn):
+    try:
+        import zstandard
+    except ImportError:
+        raise(MissingZstandard(
+            '{}: Reading and writing zstd needs the zstandard module'
+            .format(fn)))
+    return zstandard
+
+def openBinaryWriter(fn):
+    kind = compressionFormat(fn)
+    if kind == 'gzip':
+        import gzip
+        # Level 6 is what gzip(1) uses. Python's default of 9 is a lot slower
+        # for log files, while gaining very little.
+        return gzip.open(fn, mode = 'wb', compresslevel = 6)
+    if kind == 'xz':
+        import lzma
+        return lzma.open(fn, mode = 'wb', preset = 3)
+    if kind == 'bzip2':
+        import bz2
+        return bz2.open(fn, mode = 'wb')
+    if kind == 'zstd':
+        zstandard = requireZstandard(fn)
+        cctx = zstandard.ZstdCompressor(level = 3, threads = -1)
+        return cctx.stream_writer(open(fn, mode = 'wb'), closefd = True)
+    return open(fn, mode = 'wb')
+
+def openBinaryReader(fn):
+    # Open a possibly compressed file for reading bytes. The readers of all
+    # formats can seek forward, by decompressing the data in between.
+    kind = compressionFormat(fn)
+    if kind == 'xz':
+        import lzma
+        return lzma.open(fn, mode = 'rb')
+    if kind == 'bzip2':
+        import bz2
+        return bz2.open(fn, mode = 'rb')
+    if kind == 'gzip':
+        import gzip
+        return gzip.open(fn, mode = 'rb')
+    if kind == 'zstd':
+        zstandard = requireZstandard(fn)
+        dctx = zstandard.ZstdDecompressor()
+        return dctx.stream_reader(open(fn, mode = 'rb'), closefd = True,
+                                  read_size = 1024 * 1024)
+    return open(fn, mode = 'rb')
+
+def openReader(fn):
+    # Open a possibly compressed file for reading text.
+    kind = compressionFormat(fn)
+    if kind == 'xz':
+        import lzma
+        return lzma.open(fn, mode = 'rt')
+    if kind == 'bzip2':
+        import bz2
+        return bz2.open(fn, mode = 'rt')
+    if kind == 'gzip':
+        import gzip
+        return gzip.open(fn, mode = 'rt')
+    if kind == 'zstd':
+        zstandard = requireZstandard(fn)
+        dctx = zstandard.ZstdDecompressor()
+        reader = dctx.stream_reader(open(fn, mode = 'rb'), closefd = True,
+                                    read_size = 1024 * 1024)
+        return io.TextIOWrapper(io.BufferedReader(reader, 1024 * 1024))
+    return open(fn)
+
+class CompressedLogWriter:
+    # A text stream, that compresses everything written to it on a background
+    # thread, so the thread producing the log does not wait for the
+    # compressor. Text is collected into larger blocks, that are handed over
+    # through a bounded queue. Should compression fall behind badly, the
+    # queue fills up and writers block instead of memory use growing without
+    # limit.
+    blockSize = 256 * 1024
+    queueDepth = 64
+
+    def __init__(self, fn, encoding = 'utf-8'):
+        self.name = fn
+        self.encoding = encoding
+        self.buffer = []
+        self.size = 0
+        self.queue = queue.Queue(maxsize = self.queueDepth)
+        self.error = None
+        self.closed = False
+        self.stream = openBinaryWriter(fn)
+        self.thread = threading.Thread(target = self.run, daemon = True,
+                                       name = 'log-compressor')
+        self.thread.start()
+        # The process may exit without closing the log explicitly. Without
+        # this, the end of the log would be lost in the compressor.
+        atexit.register(self.close)
+
+    def run(self):
+        while True:
+            block = self.queue.get()
+            if block is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self.stream.write(block)
+            except Exception as e:
+                self.error = e
+        self.stream.close()
+
+    def handOver(self):
+        if self.size == 0:
+            return
+        text = ''.join(self.buffer)
+        self.buffer = []
+        self.size = 0
+        self.queue.put(text.encode(self.encoding, errors = 'backslashreplace'))
+
+    def write(self, text):
+        if self.closed:
+            raise(ValueError('write to closed log: {}'.format(self.name)))
+        self.buffer.append(text)
+        self.size += len(text)
+        if self.size >= self.blockSize:
+            self.handOver()
+        return len(text)
+
+    def flush(self):
+        # Log handlers flush after every record. Compressors do badly when
+        # flushed that often, so this does nothing. Data is handed over in
+        # blocks, and everything is written out on close().
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.handOver()
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        atexit.unregister(self.close)
+        if self.error is not None:
+            raise(self.error)
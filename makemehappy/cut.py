@@ -2,18 +2,20 @@ import datetime
 import math
 import os
 import re
-import yaml
+import shutil
 
 import itertools as it
 
 import makemehappy.utilities as mmh
 import makemehappy.build as build
+import makemehappy.events as events
 import makemehappy.git as git
 import makemehappy.version as v
 import makemehappy.yamlstack as ys
 import makemehappy.zephyr as z
 
 from makemehappy.buildroot import BuildRoot
+from makemehappy.lock import FileLock
 from makemehappy.toplevel import Toplevel
 
 def has(key, dic, t):
@@ -80,6 +82,7 @@ class DependencyEvaluation:
 
     def note(self, d):
         self.journal.append(d)
+        events.emit('dependency', entry = d)
 
     def insertSome(self, lst, origin):
         for dep in lst:
@@ -334,6 +337,7 @@ class Trace:
     def __init__(self):
         self.data = []
         self.westData = None
+        self.sparse = {}
 
     def has(self, needle):
         return (needle in (entry['name'] for entry in self.data))
@@ -348,6 +352,9 @@ class Trace:
     def push(self, entry):
         self.data = [entry] + self.data
 
+    def sparseCheckout(self, name, path, patterns):
+        self.sparse[name] = { 'path': path, 'patterns': patterns }
+
     def west(self, kernel = None):
         if (kernel == None):
             return self.westData
@@ -423,17 +430,253 @@ def fetchCheckout(cfg, log, mod, rev):
 
     return gitCheckout(cfg, log, mod, revision)
 
+def checkoutDependency(cfg, log, dep, update = False):
+    # Check out the requested revision in the current directory, following up
+    # with moving to the latest tag, if a revision override asks for it. When
+    # updating an existing checkout, a local branch may lag behind its remote
+    # counterpart, so fast-forward it in that case.
+    rev = fetchCheckout(cfg, log, dep['name'], dep['revision'])
+    if (rev == None):
+        return False
+    dep['revision'] = rev
+    if (update and git.remoteHasBranch(rev)):
+        # Shallow histories cannot be fast-forwarded, since the merge base is
+        # usually beyond the shallow boundary. Local changes were ruled out
+        # before getting here, so resetting is just as good in that case.
+        if (git.isShallow('.')):
+            cmd = [ 'git', 'reset', '--quiet', '--hard', 'origin/' + rev ]
+        else:
+            cmd = [ 'git', 'merge', '--quiet', '--ff-only', 'origin/' + rev ]
+        rc = mmh.loggedProcess(cfg, log, cmd)
+        if (rc != 0):
+            log.error("Failed to fast-forward branch {} for module {}!"
+                      .format(rev, dep['name']))
+            return False
+    rev = cfg.processOverrides(dep['name'])
+    if (isinstance(rev, tuple) and rev[0] == '!latest'):
+        latest = git.latestTag('.', rev[1])
+        if (latest != None):
+            log.info('Moving to latest tag for {}: {}',
+                    dep['name'], latest)
+            latest = gitCheckout(cfg, log, dep['name'], latest)
+            if (latest == None):
+                raise(InvalidDependency(dep))
+            dep['revision'] = latest
+    return True
+
+def wantedRevision(rev):
+    # Returns the revision to check out, along with the commit it resolves to
+    # in the current repository. Branches resolve via their remote tracking
+    # branch, since that is where a fresh clone would put them.
+    if (isinstance(rev, list)):
+        for branch in rev:
+            if (git.remoteHasBranch(branch)):
+                return (branch, git.resolveRevision('.', 'origin/' + branch))
+        return (rev, None)
+    if (git.remoteHasBranch(rev)):
+        return (rev, git.resolveRevision('.', 'origin/' + rev))
+    return (rev, git.resolveRevision('.', rev))
+
+def needsFetch(rev):
+    # Tags and commit ids, that are available locally, do not require talking
+    # to the remote repository at all. Branches might have moved, however.
+    for r in (rev if isinstance(rev, list) else [ rev ]):
+        if (git.resolveRevision('.', r) == None or git.remoteHasBranch(r)):
+            return True
+    return False
+
+def fetchCommand(latest, rev):
+    if (not git.isShallow('.')):
+        return [ 'git', 'fetch', '--quiet', '--tags', 'origin' ]
+    if (latest or isinstance(rev, list)):
+        # Resolving the latest tag or one of a list of main branches needs
+        # the full history of all branches. Deepen, but keep leaving blobs on
+        # the remote side until they are needed.
+        mmh.devnullProcess([ 'git', 'remote', 'set-branches', 'origin', '*' ])
+        return [ 'git', 'fetch', '--quiet', '--tags', '--unshallow',
+                 '--filter=blob:none', 'origin' ]
+    return [ 'git', 'fetch', '--quiet', '--depth', '1', 'origin',
+             git.shallowRefspec('.', rev) ]
+
+def updateCheckout(cfg, log, dep):
+    name = dep['name']
+    latest = isinstance(cfg.processOverrides(name), tuple)
+    if (latest or needsFetch(dep['revision'])):
+        log.info('Fetching updates for module {}'.format(name))
+        rc = mmh.loggedProcess(cfg, log, fetchCommand(latest, dep['revision']))
+        if (rc != 0):
+            log.error("Failed to fetch updates for module {}!".format(name))
+            return False
+    if (not latest):
+        (rev, want) = wantedRevision(dep['revision'])
+        if (want != None and want == git.resolveRevision('.', 'HEAD')):
+            log.info('Module {} is up to date at {}'.format(name, want))
+            dep['revision'] = rev
+            return True
+    log.info('Updating module {} to revision {}'
+             .format(name, dep['revision']))
+    return checkoutDependency(cfg, log, dep, update = True)
+
+def requestedSparse(dep, source):
+    # Returns the list of sparse-checkout directories a dependency asks for,
+    # or None if it requires the full working tree.
+    if ('sparse' in dep):
+        patterns = dep['sparse']
+    elif ('sparse' in source):
+        patterns = source['sparse']
+    else:
+        return None
+    if (isinstance(patterns, str)):
+        return [ patterns ]
+    return list(patterns)
+
+def mergeSparse(a, b):
+    if (a == None or b == None):
+        return None
+    return a + [ x for x in b if x not in a ]
+
+def applySparse(cfg, log, path, patterns):
+    if (patterns == None):
+        if (not git.isSparse(path)):
+            return 0
+        log.info('Disabling sparse checkout in {}'.format(path))
+        return mmh.loggedProcess(cfg, log, ['git', '-C', path,
+                                            'sparse-checkout', 'disable'])
+    log.info('Using sparse checkout in {}: {}'.format(path, patterns))
+    return mmh.loggedProcess(cfg, log, ['git', '-C', path,
+                                        'sparse-checkout', 'set', '--cone']
+                                       + patterns)
+
+def widenSparse(cfg, log, trace, src, dep):
+    # A module, that was fetched already, is requested by another dependent.
+    # Its working tree has to cover the union of all requested directories.
+    if (dep['name'] not in trace.sparse):
+        return True
+    entry = trace.sparse[dep['name']]
+    if (entry['patterns'] == None):
+        return True
+    new = mergeSparse(entry['patterns'],
+                      requestedSparse(dep, getSource(dep, src)))
+    if (new == entry['patterns']):
+        return True
+    entry['patterns'] = new
+    with FileLock(entry['path'], log = log):
+        return (applySparse(cfg, log, entry['path'], new) == 0)
+
+def updateDependency(cfg, log, dep, p, sparse):
+    # Returns None if the module was left alone, in which case its sparse
+    # checkout was not touched either. Otherwise a boolean, indicating
+    # success.
+    if (os.path.islink(p)):
+        log.info("Module directory is a symbolic link. Not updating.")
+        return None
+    if (git.hasLocalChanges(p)):
+        log.warn("Module {} has local modifications. Not updating."
+                 .format(dep['name']))
+        return None
+    if (applySparse(cfg, log, p, sparse) != 0):
+        log.error("Failed to set up sparse checkout for module {}!"
+                  .format(dep['name']))
+        return False
+    olddir = os.getcwd()
+    os.chdir(p)
+    rc = updateCheckout(cfg, log, dep)
+    os.chdir(olddir)
+    return rc
+
+def cloneStrategy(cfg, log, source, dep):
+    if ('clone' in source):
+        strategy = source['clone']
+    else:
+        strategy = cfg.lookup('clone-strategy')
+    if (strategy != 'shallow'):
+        return strategy
+    # Shallow clones can only be made from a single tag or branch name. Lists
+    # of main branches, commit ids and latest-tag overrides need history to be
+    # resolved, so fall back to a blobless clone for these.
+    rev = dep['revision']
+    if (isinstance(rev, list) or git.looksLikeCommit(rev) or
+        isinstance(cfg.processOverrides(dep['name']), tuple)):
+        log.info('Revision {} of module {} needs history. Using blobless clone.'
+                 .format(rev, dep['name']))
+        return 'blobless'
+    return strategy
+
+def cloneDependency(cfg, log, source, dep, url, p, sparse):
+    strategy = cloneStrategy(cfg, log, source, dep)
+    cmd = [ 'git', '-c', 'advice.detachedHead=false', 'clone', '--quiet' ]
+    if (sparse != None):
+        # The working tree is populated after sparse-checkout is set up.
+        cmd.append('--no-checkout')
+    rc = mmh.loggedProcess(cfg, log,
+                           cmd + git.cloneArguments(strategy, dep['revision'])
+                               + [ url, p ])
+    if (rc != 0 and strategy == 'shallow'):
+        log.warn('Shallow clone of module {} failed. Retrying blobless clone.'
+                 .format(dep['name']))
+        if (os.path.exists(p)):
+            shutil.rmtree(p)
+        rc = mmh.loggedProcess(cfg, log,
+                               cmd + git.cloneArguments('blobless')
+                                   + [ url, p ])
+    return rc
+
 class InvalidRepositoryType(Exception):
     pass
 
 class InvalidDependency(Exception):
     pass
 
+def installDependency(cfg, log, trace, source, dep, url, p, sparse):
+    # Returns None on failure. Otherwise a boolean, that indicates if the state
+    # of the dependency's repository needs to be detected, since it was not
+    # put into place by this function.
+    if (os.path.exists(p) and source['type'] == 'git'
+                          and cfg.lookup('update-dependencies')):
+        log.info("Module directory exists. Updating checkout.")
+        rc = updateDependency(cfg, log, dep, p, sparse)
+        if (rc == False):
+            return None
+        if (rc == True):
+            trace.sparseCheckout(dep['name'], p, sparse)
+    elif (os.path.exists(p)):
+        log.info("Module directory exists. Skipping initialisation.")
+    elif (source['type'] == 'symlink'):
+        log.info("Symlinking dependency: {} to {}" .format(dep['name'], url))
+        os.symlink(url, p)
+    elif (source['type'] == 'git'):
+        rc = cloneDependency(cfg, log, source, dep, url, p, sparse)
+        if (rc != 0):
+            log.error("Failed to clone code for module {}!"
+                      .format(dep['name']))
+            return None
+        if (sparse != None):
+            if (applySparse(cfg, log, p, sparse) != 0):
+                log.error("Failed to set up sparse checkout for module {}!"
+                          .format(dep['name']))
+                return None
+            trace.sparseCheckout(dep['name'], p, sparse)
+        # Check out the requested revision
+        olddir = os.getcwd()
+        os.chdir(p)
+        rc = checkoutDependency(cfg, log, dep)
+        os.chdir(olddir)
+        if (rc == False):
+            return None
+        return False
+    else:
+        raise(InvalidRepositoryType(source))
+    return True
+
 def fetch(cfg, log, src, st, trace):
     if (st.empty() == True):
         return trace
 
     for dep in st.data:
+        if (trace.has(dep['name'])):
+            # Several dependents requested this module in the same round. It
+            # was fetched for the first one of them already.
+            continue
         rover = revisionOverride(cfg, src, dep['name'])
         if (rover != None):
             log.info("Revision Override for {} to {}"
@@ -463,41 +706,15 @@ def fetch(cfg, log, src, st, trace):
         zpkg = z.westNameFromSourceStack(src, dep['name'])
         p = os.path.join('deps', zpkg if zpkg != None else dep['name'])
         newmod = os.path.join(p, 'module.yaml')
-        detectrev = True
-        if (os.path.exists(p)):
-            log.info("Module directory exists. Skipping initialisation.")
-        elif (source['type'] == 'symlink'):
-            log.info("Symlinking dependency: {} to {}" .format(dep['name'], url))
-            os.symlink(url, p)
-        elif (source['type'] == 'git'):
-            rc = mmh.loggedProcess(cfg, log, ['git',
-                                              '-c', 'advice.detachedHead=false',
-                                              'clone', '--quiet', url, p])
-            if (rc != 0):
-                log.error("Failed to clone code for module {}!"
-                          .format(dep['name']))
-                return False
-            # Check out the requested revision
-            olddir = os.getcwd()
-            os.chdir(p)
-            rev = fetchCheckout(cfg, log, dep['name'], dep['revision'])
-            if (rev == None):
-                return False
-            dep['revision'] = rev
-            rev = cfg.processOverrides(dep['name'])
-            if (isinstance(rev, tuple) and rev[0] == '!latest'):
-                latest = git.latestTag('.', rev[1])
-                if (latest != None):
-                    log.info('Moving to latest tag for {}: {}',
-                            dep['name'], latest)
-                    latest = gitCheckout(cfg, log, dep['name'], latest)
-                    if (latest == None):
-                        raise(InvalidDependency(dep))
-                    dep['revision'] = latest
-            os.chdir(olddir)
-            detectrev = False
-        else:
-            raise(InvalidRepositoryType(source))
+        sparse = requestedSparse(dep, source)
+        for other in st.data:
+            if (other is not dep and other['name'] == dep['name']):
+                sparse = mergeSparse(sparse, requestedSparse(other, source))
+        with FileLock(p, log = log):
+            detectrev = installDependency(cfg, log, trace, source,
+                                          dep, url, p, sparse)
+        if (detectrev == None):
+            return False
 
         if (isinstance(dep['revision'], list)):
             for branch in dep['revision']:
@@ -529,6 +746,10 @@ def fetch(cfg, log, src, st, trace):
         for newdep in newmodata['dependencies']:
             if (trace.has(newdep['name']) == False):
                 st.push(newdep)
+            elif (widenSparse(cfg, log, trace, src, newdep) == False):
+                log.error("Failed to widen sparse checkout for module {}!"
+                          .format(newdep['name']))
+                return False
 
         st.delete(dep['name'])
 
@@ -594,52 +815,66 @@ class ExecutionStatistics:
         self.log = log
         self.data = []
 
+    # All changes to the statistics log go through these two, so that they
+    # show up in the event stream as well. See makemehappy/events.py.
+    def append(self, entry):
+        self.data.append(entry)
+        events.emit('statistics', entry = entry)
+
+    def update(self, step, rc, fields):
+        self.data[-1].update(fields)
+        events.emit('step', step = step, rc = rc, update = fields)
+
     def checkpoint(self, description):
-        self.data.append( { 'type': 'checkpoint',
-                            'description': description,
-                            'time-stamp': datetime.datetime.now() } )
+        self.append( { 'type': 'checkpoint',
+                       'description': description,
+                       'time-stamp': datetime.datetime.now() } )
 
     def build(self, toolchain, cpu, buildcfg, buildtool):
-        self.data.append( { 'type':      'build',
-                            'toolchain': toolchain,
-                            'cpu':       cpu,
-                            'buildcfg':  buildcfg,
-                            'buildtool': buildtool,
-                            'time-stamp': datetime.datetime.now() } )
+        self.append( { 'type':      'build',
+                       'toolchain': toolchain,
+                       'cpu':       cpu,
+                       'buildcfg':  buildcfg,
+                       'buildtool': buildtool,
+                       'time-stamp': datetime.datetime.now() } )
 
     def systemBoard(self, toolchain, board, buildcfg, buildtool):
-        self.data.append( { 'type':      'system-board',
-                            'toolchain': toolchain,
-                            'board':     board,
-                            'buildcfg':  buildcfg,
-                            'buildtool': buildtool,
-                            'time-stamp': datetime.datetime.now() } )
+        self.append( { 'type':      'system-board',
+                       'toolchain': toolchain,
+                       'board':     board,
+                       'buildcfg':  buildcfg,
+                       'buildtool': buildtool,
+                       'time-stamp': datetime.datetime.now() } )
 
     def systemZephyr(self, app, toolchain, board, buildcfg, buildtool):
-        self.data.append( { 'type':      'system-zephyr',
-                            'application': app,
-                            'toolchain': toolchain,
-                            'board':     board,
-                            'buildcfg':  buildcfg,
-                            'buildtool': buildtool,
-                            'time-stamp': datetime.datetime.now() } )
+        self.append( { 'type':      'system-zephyr',
+                       'application': app,
+                       'toolchain': toolchain,
+                       'board':     board,
+                       'buildcfg':  buildcfg,
+                       'buildtool': buildtool,
+                       'time-stamp': datetime.datetime.now() } )
 
     def logConfigure(self, result):
-        self.data[-1]['configure-stamp'] = datetime.datetime.now()
-        self.data[-1]['configure-result'] = (result == 0)
+        self.update('configure', result,
+                    { 'configure-stamp': datetime.datetime.now(),
+                      'configure-result': (result == 0) })
 
     def logBuild(self, result):
-        self.data[-1]['build-stamp'] = datetime.datetime.now()
-        self.data[-1]['build-result'] = (result == 0)
+        self.update('build', result,
+                    { 'build-stamp': datetime.datetime.now(),
+                      'build-result': (result == 0) })
 
     def logInstall(self, result):
-        self.data[-1]['install-stamp'] = datetime.datetime.now()
-        self.data[-1]['install-result'] = (result == 0)
+        self.update('install', result,
+                    { 'install-stamp': datetime.datetime.now(),
+                      'install-result': (result == 0) })
 
     def logTestsuite(self, num, result):
-        self.data[-1]['testsuite-stamp'] = datetime.datetime.now()
-        self.data[-1]['testsuite-tests'] = num
-        self.data[-1]['testsuite-result'] = (result == 0)
+        self.update('testsuite', result,
+                    { 'testsuite-stamp': datetime.datetime.now(),
+                      'testsuite-tests': num,
+                      'testsuite-result': (result == 0) })
 
     def wasSuccessful(self):
         for entry in self.data:
@@ -874,6 +1109,10 @@ def outputMMHYAML(version, fn, data, args):
 
 def updateMMHYAML(log, root, version, args):
     fn = os.path.join(root, 'MakeMeHappy.yaml')
+    with FileLock(fn, log = log):
+        updateMMHYAMLLocked(log, fn, version, args)
+
+def updateMMHYAMLLocked(log, fn, version, args):
     data = None
 
     if (os.path.exists(fn)):
@@ -963,6 +1202,7 @@ class CodeUnderTest:
         self.sources.merge()
 
     def initRoot(self, version, args):
+        import yaml
         self.root = BuildRoot(log = self.log,
                               seed = yaml.dump(self.moduleData),
                               modName = self.name(),
@@ -981,15 +1221,16 @@ class CodeUnderTest:
     def cmakeIntoYAML(self):
         self.log.info("Updating MakeMeHappy.yaml with CMake information")
         fn = os.path.join('MakeMeHappy.yaml')
-        data = mmh.load(fn)
-        data['cmake'] = {}
-        data['cmake']['module-path'] = self.extensions.modulePath()
-        data['cmake']['toolchain-path'] = self.extensions.toolchainPath()
-        data['zephyr'] = {}
-        data['zephyr']['board-root'] = self.zephyr.boardRoot()
-        data['zephyr']['dts-root'] = self.zephyr.dtsRoot()
-        data['zephyr']['soc-root'] = self.zephyr.socRoot()
-        mmh.dump(fn, data)
+        with FileLock(fn, log = self.log):
+            data = mmh.load(fn)
+            data['cmake'] = {}
+            data['cmake']['module-path'] = self.extensions.modulePath()
+            data['cmake']['toolchain-path'] = self.extensions.toolchainPath()
+            data['zephyr'] = {}
+            data['zephyr']['board-root'] = self.zephyr.boardRoot()
+            data['zephyr']['dts-root'] = self.zephyr.dtsRoot()
+            data['zephyr']['soc-root'] = self.zephyr.socRoot()
+            mmh.dump(fn, data)
 
     def populateRoot(self):
         self.root.populate()
@@ -0,0 +1,251 @@
+import datetime
+import json
+import os
+import shutil
+
+import makemehappy.cut as cut
+import makemehappy.git as git
+import makemehappy.utilities as mmh
+
+from makemehappy.lock import FileLock
+
+stateFile = '.mmh-download-sources.json'
+
+# Clones are made into a directory of this suffix, that is renamed into place
+# when the clone succeeded. A directory of that name can only be the remains
+# of an interrupted clone, so it is removed before cloning again.
+partialSuffix = '.mmh-partial'
+
+def repositoryKind(d):
+    if (os.path.exists(os.path.join(d, '.git'))):
+        return 'working'
+    if (os.path.isfile(os.path.join(d, 'HEAD'))
+            and os.path.isdir(os.path.join(d, 'objects'))):
+        return 'bare'
+    return None
+
+def runGit(job, cmd):
+    (stdout, stderr, rc) = mmh.stdoutProcess(cmd)
+    job['output'].append({ 'command': cmd, 'stdout': stdout,
+                           'stderr': stderr, 'rc': rc })
+    return rc
+
+def checkoutMain(job):
+    for branch in job['main']:
+        if (git.remoteHasBranch(branch, job['directory'])):
+            break
+    else:
+        return None
+
+    rc = runGit(job, [ 'git', '-C', job['directory'],
+                       '-c', 'advice.detachedHead=false',
+                       'checkout', '--quiet', branch ])
+    if (rc == 0 and job['action'] == 'fetch'):
+        rc = runGit(job, [ 'git', '-C', job['directory'], 'merge',
+                           '--quiet', '--ff-only', 'origin/' + branch ])
+    return (branch if rc == 0 else None)
+
+def download(job):
+    # This runs in a worker thread. It does not log anything by itself, but
+    # records all output in the job, for the main thread to report it.
+    start = datetime.datetime.now()
+    with FileLock(job['directory']):
+        downloadLocked(job)
+    job['time'] = datetime.datetime.now() - start
+    return job
+
+def downloadLocked(job):
+    d = job['directory']
+    bare = job['bare']
+    partial = d + partialSuffix
+    if (os.path.exists(partial)):
+        shutil.rmtree(partial)
+
+    if (os.path.exists(d)):
+        job['action'] = 'fetch'
+        # Anything, that is not a repository of the requested kind, may hold
+        # somebody's work. It is reported and left alone.
+        kind = repositoryKind(d)
+        wanted = 'bare' if bare else 'working'
+        if (kind != wanted):
+            job['error'] = ('{} is not a {} repository. Leaving it alone.'
+                            .format(d, wanted))
+            job['result'] = False
+            return
+        cmd = [ 'git', '-C', d, 'fetch', '--quiet', '--prune', '--tags',
+                'origin' ]
+        if (bare):
+            # Bare clones do not configure a fetch refspec, and their branches
+            # live directly in refs/heads.
+            cmd.append('+refs/heads/*:refs/heads/*')
+    else:
+        job['action'] = 'clone'
+        cmd = [ 'git', '-c', 'advice.detachedHead=false', 'clone', '--quiet' ]
+        if (bare):
+            cmd.append('--bare')
+        cmd += [ job['repository'], partial ]
+
+    job['result'] = (runGit(job, cmd) == 0)
+    if (job['action'] == 'clone'):
+        if (job['result']):
+            os.rename(partial, d)
+        elif (os.path.exists(partial)):
+            shutil.rmtree(partial)
+    if (job['result'] and not bare):
+        job['revision'] = checkoutMain(job)
+        job['result'] = (job['revision'] != None)
+
+# With --resume, modules, that an interrupted run finished, are not downloaded
+# again. The state file names the run, the destination it downloaded to and
+# whether it made bare clones. Only a run matching the current one in both is
+# resumed. Without --resume, everything is refreshed, and a new run starts.
+
+def newState(destination, bare):
+    return { 'run':         datetime.datetime.now().isoformat(),
+             'destination': os.path.realpath(destination),
+             'bare':        bare,
+             'done':        {} }
+
+def loadState(fn):
+    if (not os.path.isfile(fn)):
+        return None
+    try:
+        with open(fn) as fh:
+            data = json.load(fh)
+    except ValueError:
+        return None
+    if (not isinstance(data, dict)
+            or not all(key in data for key in newState('.', False))):
+        return None
+    return data
+
+def saveState(fn, state):
+    with mmh.atomicFile(fn) as fh:
+        json.dump(state, fh, indent = 2, sort_keys = True)
+        fh.write('\n')
+
+def resumeState(log, fn, state):
+    # Returns the state of the run to resume, or state if there is none.
+    old = loadState(fn)
+    if (old is None):
+        log.info("No interrupted download to resume in {}.", fn)
+        return state
+    if (old['destination'] != state['destination']
+            or old['bare'] != state['bare']):
+        log.warn("Download state in {} is from a different kind of run. "
+                 "Not resuming.", fn)
+        return state
+    log.info("Resuming download run {}.", old['run'])
+    return old
+
+def listJobs(log, src, destination, bare):
+    jobs = []
+    loaded = {}
+    for source in src.data:
+        if 'modules' not in source:
+            continue
+        sf = os.path.join(source['root'], source['definition'])
+        for module in source['modules']:
+            if (module in loaded):
+                log.info("Module {} already defined by {}",
+                         module, loaded[module])
+                continue
+            loaded[module] = sf
+            meta = src.lookup(module)
+            main = meta['main']
+            jobs.append({ 'module':     module,
+                          'source':     sf,
+                          'repository': meta['repository'],
+                          'main':       [ main ] if isinstance(main, str)
+                                                 else main,
+                          'directory':  os.path.join(destination, module),
+                          'bare':       bare,
+                          'action':     None,
+                          'revision':   None,
+                          'result':     False,
+                          'time':       None,
+                          'error':      None,
+                          'output':     [] })
+    return jobs
+
+def reportJob(log, args, job):
+    mmh.maybeShowPhase(log, job['module'], 'download-sources', args)
+    log.info("Downloading module {} from {}...",
+             job['module'], job['repository'])
+    for entry in job['output']:
+        log.info("Running command: {}".format(entry['command']))
+        for text in (entry['stdout'], entry['stderr']):
+            for line in text.splitlines():
+                log.info(line)
+    if (job['error'] is not None):
+        log.error(job['error'])
+    if (job['result']):
+        log.info("Downloading module {} was successful.", job['module'])
+    else:
+        log.error("Downloading module {} failed!", job['module'])
+
+def renderTimingTable(log, jobs):
+    log.info('{:<40} {:>7} {:>12} {:>10}'
+             .format('Module', 'Action', 'Time', 'Result'))
+    for job in sorted(jobs, key = lambda x: x['module']):
+        if (job['time'] == None):
+            time = '---'
+        else:
+            time = cut.renderTimedelta(job['time'])
+        log.info('{:<40} {:>7} {:>12} {:>10}'
+                 .format(job['module'], job['action'], time,
+                         'Success' if job['result'] else 'Failure'))
+
+def downloadSources(cfg, log, src, args):
+    destination = args.destination
+    if (not os.path.exists(destination)):
+        os.makedirs(destination)
+    fn = os.path.join(destination, stateFile)
+    state = newState(destination, args.clone_bare)
+    if (args.resume):
+        state = resumeState(log, fn, state)
+    jobs = listJobs(log, src, destination, args.clone_bare)
+
+    # The state file is removed once everything succeeded.
+    todo = []
+    for job in jobs:
+        if (job['module'] in state['done']):
+            job['action'] = 'resume'
+            job['result'] = True
+            job['revision'] = state['done'][job['module']]
+        else:
+            todo.append(job)
+    if (len(todo) < len(jobs)):
+        log.info("Resuming interrupted download: {} of {} modules done.",
+                 len(jobs) - len(todo), len(jobs))
+
+    log.info("Downloading {} modules using {} job(s)...",
+             len(todo), args.jobs)
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    with ThreadPoolExecutor(max_workers = max(1, args.jobs)) as pool:
+        futures = [ pool.submit(download, job) for job in todo ]
+        for future in as_completed(futures):
+            job = future.result()
+            reportJob(log, args, job)
+            if (job['result']):
+                state['done'][job['module']] = job['revision']
+                saveState(fn, state)
+
+    failed = [ job for job in jobs if not job['result'] ]
+    for job in sorted(jobs, key = lambda x: x['module']):
+        if (job['result']):
+            log.info("  Success: {} ({}) from {} [{}]",
+                     job['module'], job['revision'],
+                     job['repository'], job['source'])
+    renderTimingTable(log, jobs)
+    if (len(failed) == 0):
+        if (os.path.exists(fn)):
+            os.unlink(fn)
+        log.info("Downloading ALL sources succeeded!")
+        return True
+
+    log.error("Downloading {} of {} sources failed!", len(failed), len(jobs))
+    for job in failed:
+        log.error("  Failure: {} from {} [{}]",
+                  job['module'], job['repository'], job['source'])
+    return False
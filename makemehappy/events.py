@@ -0,0 +1,91 @@
+import datetime
+import json
+
+import makemehappy.compression as compression
+
+# Machine readable event stream. With --events FILE, mmh writes one JSON object
+# per line to FILE, describing what happens during a run: Build instances and
+# their phases, the results and exit codes of those, test counts, dependency
+# journal entries and checkpoints. Every event has an "event" key naming its
+# kind, and a "time" key with an ISO 8601 time-stamp.
+#
+# The events, that ExecutionStatistics emits, carry enough information for
+# loadStatistics() to rebuild its data. That allows show-result to render the
+# result table from an event file, without scanning the text log.
+
+sink = None
+
+class InvalidEventFile(Exception):
+    pass
+
+def setFile(fn):
+    global sink
+    if compression.compressionFormat(fn) is not None:
+        sink = compression.CompressedLogWriter(fn)
+    else:
+        # Line buffered, so the file can be followed while mmh is running.
+        sink = open(fn, mode = 'w', buffering = 1)
+
+def close():
+    global sink
+    if sink is not None:
+        sink.close()
+        sink = None
+
+def isEventFile(fn):
+    return compression.plainName(fn).endswith('.jsonl')
+
+def encode(thing):
+    if isinstance(thing, datetime.datetime):
+        return thing.isoformat()
+    return str(thing)
+
+def emit(kind, **data):
+    if sink is None:
+        return
+    record = { 'event': kind, 'time': datetime.datetime.now().isoformat() }
+    record.update(data)
+    sink.write(json.dumps(record, default = encode) + '\n')
+
+def read(fn):
+    # JSON-lines files, that mmh did not write, are rejected at the first
+    # record, that is not an event.
+    with compression.openReader(fn) as fh:
+        for (n, line) in enumerate(fh, 1):
+            if (len(line.strip()) == 0):
+                continue
+            try:
+                ev = json.loads(line)
+            except ValueError as e:
+                raise(InvalidEventFile('{}:{}: {}'.format(fn, n, e)))
+            if (not isinstance(ev, dict) or 'event' not in ev):
+                raise(InvalidEventFile('{}:{}: Not an mmh event'
+                                       .format(fn, n)))
+            yield ev
+
+stampKeys = [ 'time-stamp', 'configure-stamp', 'build-stamp',
+              'testsuite-stamp', 'install-stamp' ]
+
+def decodeStamps(datum):
+    for key in stampKeys:
+        if key in datum:
+            datum[key] = datetime.datetime.fromisoformat(datum[key])
+    return datum
+
+def loadStatistics(fn):
+    # Returns the statistics data from an event file, as well as the data of
+    # the final result event, if the file contains one.
+    data = []
+    result = None
+    for ev in read(fn):
+        kind = ev['event']
+        try:
+            if kind == 'statistics':
+                data.append(decodeStamps(ev['entry']))
+            elif kind == 'step' and len(data) > 0:
+                data[-1].update(decodeStamps(ev['update']))
+            elif kind == 'result':
+                result = ev
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise(InvalidEventFile('{}: Malformed {} event'.format(fn, kind)))
+    return (data, result)
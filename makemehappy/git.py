@@ -2,6 +2,46 @@ import re
 
 import makemehappy.utilities as mmh
 
+class InvalidCloneStrategy(Exception):
+    pass
+
+commitId = re.compile(r'^[0-9a-fA-F]{7,40}$')
+
+def looksLikeCommit(rev):
+    return (re.match(commitId, rev) is not None)
+
+def cloneArguments(strategy, revision = None):
+    if (strategy == 'full'):
+        return []
+    if (strategy == 'blobless'):
+        return [ '--filter=blob:none' ]
+    if (strategy == 'shallow'):
+        return [ '--depth', '1', '--branch', revision ]
+    raise(InvalidCloneStrategy(strategy))
+
+def isShallow(path):
+    (stdout, stderr, rc) = mmh.stdoutProcess(
+        ['git', '-C', path, 'rev-parse', '--is-shallow-repository'])
+    return (rc == 0 and stdout == 'true')
+
+def remoteRefs(path, rev):
+    (stdout, stderr, rc) = mmh.stdoutProcess(
+        ['git', '-C', path, 'ls-remote', 'origin', rev])
+    if (rc != 0):
+        return []
+    return [ line.split()[1] for line in stdout.splitlines() if line != '' ]
+
+def shallowRefspec(path, rev):
+    # Shallow clones only know about the ref they were made from. Fetching a
+    # different revision needs an explicit refspec, that puts tags and branches
+    # where a regular clone would; anything else is treated like a commit id.
+    refs = remoteRefs(path, rev)
+    if (('refs/tags/' + rev) in refs):
+        return '+refs/tags/{0}:refs/tags/{0}'.format(rev)
+    if (('refs/heads/' + rev) in refs):
+        return '+refs/heads/{0}:refs/remotes/origin/{0}'.format(rev)
+    return rev
+
 def latestTag(path, pattern):
     (stdout, stderr, rc) = mmh.stdoutProcess(
         ['git', '-C', path,
@@ -10,10 +50,24 @@ def latestTag(path, pattern):
         return None
     return re.sub(r'-\d+-g?[0-9a-fA-F]+$', '', stdout)
 
-def remoteHasBranch(rev):
-    rc = mmh.devnullProcess(['git', 'rev-parse', '--verify', 'origin/' + rev])
+def remoteHasBranch(rev, path = '.'):
+    rc = mmh.devnullProcess(['git', '-C', path,
+                             'rev-parse', '--verify', 'origin/' + rev])
     return (rc == 0)
 
+def resolveRevision(path, rev):
+    (stdout, stderr, rc) = mmh.stdoutProcess(
+        ['git', '-C', path,
+         'rev-parse', '--quiet', '--verify', rev + '^{commit}'])
+    if (rc != 0):
+        return None
+    return stdout
+
+def hasLocalChanges(path):
+    (stdout, stderr, rc) = mmh.stdoutProcess(
+        ['git', '-C', path, 'status', '--porcelain', '--untracked-files=no'])
+    return (rc != 0 or stdout != '')
+
 def detectRevision(log, path):
     (stdout, stderr, rc) = mmh.stdoutProcess(
         ['git', '-C', path,
@@ -30,3 +84,8 @@ def detectRevision(log, path):
         return stdout
     log.info("Could not determine repository state: {}".format(stderr))
     return None
+
+def isSparse(path):
+    (stdout, stderr, rc) = mmh.stdoutProcess(
+        ['git', '-C', path, 'config', '--get', 'core.sparseCheckout'])
+    return (rc == 0 and stdout == 'true')
@@ -0,0 +1,254 @@
+import datetime
+import hashlib
+import json
+import sqlite3
+
+import makemehappy.compression as compression
+import makemehappy.result as result
+
+# A database of compiler incidents, collected from many runs. Every run is
+# stored under a name, like a revision or a build number. Runs can then be
+# compared, to tell which incidents a change introduced.
+#
+# Incidents are stored once per run, along with the number of times they were
+# seen. The build instances, an incident was seen in, are stored separately,
+# along with the toolchain used by the instance.
+
+schema = [
+    '''CREATE TABLE IF NOT EXISTS runs (
+           id       INTEGER PRIMARY KEY,
+           name     TEXT NOT NULL UNIQUE,
+           time     TEXT NOT NULL,
+           sources  TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS incidents (
+           id       INTEGER PRIMARY KEY,
+           run      INTEGER NOT NULL REFERENCES runs(id),
+           key      INTEGER NOT NULL,
+           kind     TEXT,
+           file     TEXT,
+           line     TEXT,
+           col      TEXT,
+           category TEXT,
+           text     TEXT,
+           count    INTEGER NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS instances (
+           incident  INTEGER NOT NULL REFERENCES incidents(id),
+           instance  TEXT NOT NULL,
+           toolchain TEXT)''',
+    'CREATE INDEX IF NOT EXISTS incidents_key ON incidents (run, key)',
+    'CREATE INDEX IF NOT EXISTS incidents_file ON incidents (run, file)',
+    'CREATE INDEX IF NOT EXISTS incidents_category '
+    + 'ON incidents (run, category)',
+    'CREATE INDEX IF NOT EXISTS instances_incident ON instances (incident)',
+    'CREATE INDEX IF NOT EXISTS instances_toolchain ON instances (toolchain)',
+    'CREATE INDEX IF NOT EXISTS instances_instance ON instances (instance)' ]
+
+class UnknownRun(Exception):
+    pass
+
+class NoRuns(Exception):
+    pass
+
+def connect(fn):
+    db = sqlite3.connect(fn)
+    db.execute('PRAGMA journal_mode = WAL')
+    db.execute('PRAGMA synchronous = NORMAL')
+    for statement in schema:
+        db.execute(statement)
+    db.commit()
+    return db
+
+def incidentKey(key):
+    # Runs are compared by a 64 bit digest of their incidents' keys. That keeps
+    # the index, that comparisons use, small.
+    digest = hashlib.blake2b(repr(key).encode(), digest_size = 8).digest()
+    return int.from_bytes(digest, 'big', signed = True)
+
+def isJSONLines(fn):
+    return compression.plainName(fn).endswith('.jsonl')
+
+def isJSON(fn):
+    return (isJSONLines(fn) or compression.plainName(fn).endswith('.json'))
+
+def loadJSON(fn):
+    # Reads the output of "show-result --json", or the JSON-lines files, that
+    # live-incidents writes. Older files do not carry counts and instances.
+    table = result.IncidentTable()
+    with result.multiOpen(fn) as fh:
+        if (isJSONLines(fn)):
+            data = [ json.loads(line) for line in fh if line.strip() ]
+        else:
+            data = json.load(fh)
+    table.merge(((d['kind'], d['file-name'], d['line'], d['column'],
+                  d['category'], d['text']),
+                 d.get('count', 1),
+                 d.get('instances', [])) for d in data)
+    return table
+
+def collect(files, jobs = 1):
+    table = result.IncidentTable()
+    logs = []
+    for fn in files:
+        if (isJSON(fn)):
+            table.merge(loadJSON(fn).pack())
+        else:
+            logs.append(fn)
+    if (len(logs) > 0):
+        table.merge(result.scanFiles(logs, jobs = jobs).pack())
+    return table
+
+def ingest(db, name, files, jobs = 1):
+    # Stores the incidents from all files as run name. A run of that name,
+    # that exists already, is replaced. Returns the number of incidents.
+    table = collect(files, jobs)
+    with db:
+        db.execute('BEGIN IMMEDIATE')
+        dropRun(db, name)
+        cur = db.execute(
+            'INSERT INTO runs (name, time, sources) VALUES (?, ?, ?)',
+            (name, datetime.datetime.now().isoformat(), json.dumps(files)))
+        run = cur.lastrowid
+        # Row ids are handed out here, so incidents and their instances can
+        # be inserted in two large batches.
+        (first,) = db.execute(
+            'SELECT COALESCE(MAX(id), 0) + 1 FROM incidents').fetchone()
+        rows = []
+        links = []
+        toolchains = {}
+        for (n, (key, count, instances)) in enumerate(table.pack(), first):
+            rows.append((n, run, incidentKey(key)) + tuple(key) + (count,))
+            for instance in instances:
+                if instance not in toolchains:
+                    toolchains[instance] = result.instanceToolchain(instance)
+                links.append((n, instance, toolchains[instance]))
+        db.executemany('INSERT INTO incidents VALUES '
+                       + '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        db.executemany('INSERT INTO instances VALUES (?, ?, ?)', links)
+    return len(rows)
+
+def dropRun(db, name):
+    row = db.execute('SELECT id FROM runs WHERE name = ?', (name,)).fetchone()
+    if row is None:
+        return
+    db.execute('DELETE FROM instances WHERE incident IN '
+               + '(SELECT id FROM incidents WHERE run = ?)', row)
+    db.execute('DELETE FROM incidents WHERE run = ?', row)
+    db.execute('DELETE FROM runs WHERE id = ?', row)
+
+def findRun(db, name = None):
+    # Returns the (id, name) of the named run, or the latest one if name is
+    # None.
+    if name is None:
+        row = db.execute(
+            'SELECT id, name FROM runs ORDER BY id DESC LIMIT 1').fetchone()
+        if row is None:
+            raise(NoRuns())
+        return row
+    row = db.execute('SELECT id, name FROM runs WHERE name = ?',
+                     (name,)).fetchone()
+    if row is None:
+        raise(UnknownRun(name))
+    return row
+
+def findBaseline(db, run, name = None):
+    # Without a name, the baseline is the run ingested before run.
+    if name is not None:
+        return findRun(db, name)
+    row = db.execute('SELECT id, name FROM runs WHERE id < ? '
+                     + 'ORDER BY id DESC LIMIT 1', (run[0],)).fetchone()
+    if row is None:
+        raise(UnknownRun('No run before {}'.format(run[1])))
+    return row
+
+def listRuns(db):
+    return db.execute('''
+        SELECT r.name, r.time, COUNT(i.id), COALESCE(SUM(i.count), 0)
+          FROM runs r LEFT JOIN incidents i ON i.run = r.id
+         GROUP BY r.id ORDER BY r.id''').fetchall()
+
+def loadTable(db, query, parameters):
+    # Runs a query for incident ids and returns those incidents as an
+    # IncidentTable.
+    table = result.IncidentTable()
+    rows = db.execute('''
+        SELECT i.kind, i.file, i.line, i.col, i.category, i.text, i.count,
+               GROUP_CONCAT(s.instance, char(10))
+          FROM incidents i LEFT JOIN instances s ON s.incident = i.id
+         WHERE i.id IN ({}) GROUP BY i.id ORDER BY i.id'''.format(query),
+                      parameters)
+    table.merge((row[:6], row[6],
+                 [] if row[7] is None else row[7].split('\n'))
+                for row in rows)
+    return table
+
+def newIncidents(db, run, baseline):
+    return loadTable(db, '''
+        SELECT n.id FROM incidents n
+         WHERE n.run = ? AND NOT EXISTS
+               (SELECT 1 FROM incidents b WHERE b.run = ? AND b.key = n.key)''',
+                     (run[0], baseline[0]))
+
+def topCategories(db, run, limit):
+    # Returns a dictionary, that maps toolchains to lists of (category,
+    # incidents, count) tuples, the most frequent categories first. Counts
+    # include all instances an incident was seen in.
+    rows = db.execute('''
+        SELECT toolchain, category, COUNT(*), SUM(count) FROM
+               (SELECT DISTINCT i.id, COALESCE(s.toolchain, '-') AS toolchain,
+                       COALESCE(i.category, '-') AS category, i.count
+                  FROM incidents i LEFT JOIN instances s ON s.incident = i.id
+                 WHERE i.run = ?)
+         GROUP BY toolchain, category
+         ORDER BY toolchain, COUNT(*) DESC, SUM(count) DESC''', (run[0],))
+    rv = {}
+    for (toolchain, category, incidents, count) in rows:
+        lst = rv.setdefault(toolchain, [])
+        if len(lst) < limit:
+            lst.append((category, incidents, count))
+    return rv
+
+def renderRuns(db):
+    print('{:<30} {:<26} {:>10} {:>10}'
+          .format('Run', 'Time', 'Incidents', 'Count'))
+    for (name, time, incidents, count) in listRuns(db):
+        print('{:<30} {:<26} {:>10} {:>10}'
+              .format(name, time, incidents, count))
+    return True
+
+def renderTop(db, run, limit):
+    print('Top categories in run {}:'.format(run[1]))
+    for (toolchain, lst) in sorted(topCategories(db, run, limit).items()):
+        print('\n{}:'.format(toolchain))
+        print('  {:<40} {:>8} {:>10}'.format('Category', 'Unique', 'Count'))
+        for (category, incidents, count) in lst:
+            print('  {:<40} {:>8} {:>10}'.format(category, incidents, count))
+    return True
+
+def run(cfg, log, args):
+    db = connect(args.database)
+    try:
+        if (args.incidents == 'ingest'):
+            name = args.name
+            if name is None:
+                name = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+            n = ingest(db, name, result.expandFiles(args.files), args.jobs)
+            log.info('Stored {} incident(s) as run {} in {}'
+                     .format(n, name, args.database))
+            return True
+        if (args.incidents == 'list'):
+            return renderRuns(db)
+        if (args.incidents == 'top'):
+            return renderTop(db, findRun(db, args.run), args.limit)
+
+        # new and gate: Both show the incidents, that are not part of the
+        # baseline run. Only gate fails, if there are any.
+        current = findRun(db, args.run)
+        baseline = findBaseline(db, current, args.baseline)
+        table = newIncidents(db, current, baseline)
+        if (args.json_incidents == False):
+            print('New in run {}, compared to run {}:'
+                  .format(current[1], baseline[1]))
+        result.reportIncidents(args, table)
+        return (args.incidents == 'new' or len(table) == 0)
+    finally:
+        db.close()
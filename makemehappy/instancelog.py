@@ -0,0 +1,96 @@
+import contextlib
+import fnmatch
+import os
+
+import makemehappy.utilities as mmh
+
+from makemehappy.lock import FileLock
+
+# With instance-logs enabled, the output of every build instance goes to a
+# file of its own, below the logs directory of the build root. An index file
+# in that directory maps instance names to their log files, the size of those
+# and the offsets at which the individual build phases start.
+
+logDirectory = 'logs'
+indexFile = 'index.yaml'
+
+def logRoot(root):
+    return os.path.join(root, logDirectory)
+
+def logName(name):
+    return name + '.log'
+
+def indexName(root):
+    return os.path.join(logRoot(root), indexFile)
+
+def loadIndex(fn):
+    # The index holds nothing but the instances. Indices written by earlier
+    # versions carried the absolute path of the build root as well, which is
+    # dropped here.
+    if (not os.path.isfile(fn)):
+        return { 'instances': {} }
+    with open(fn, mode = 'rb') as fh:
+        data = mmh.parseText(fh.read())
+    if (not isinstance(data, dict) or 'instances' not in data):
+        return { 'instances': {} }
+    return { 'instances': data['instances'] }
+
+def updateIndex(root, name, fn, info):
+    index = indexName(root)
+    with FileLock(index):
+        data = loadIndex(index)
+        data['instances'][name] = {
+            'log':    os.path.relpath(fn, logRoot(root)),
+            'size':   info['size'],
+            'phases': info['phases'] }
+        mmh.dumpPlain(index, data)
+
+def enabled(cfg, log):
+    handler = mmh.batchHandler(log)
+    return (cfg.lookup('instance-logs') and handler is not None
+                                        and handler.logsToFile())
+
+@contextlib.contextmanager
+def capture(cfg, log, root, name, combine = False):
+    # Send everything logged within the context to the instance's own log
+    # file. If combine is True, or configured in instance-logs-combined, the
+    # instance log is appended to the main log when the instance is done.
+    if (not enabled(cfg, log)):
+        yield
+        return
+
+    handler = mmh.batchHandler(log)
+    fn = os.path.join(logRoot(root), logName(name))
+    log.info('Logging instance {} to {}'.format(name, fn))
+    handler.openInstance(fn)
+    try:
+        yield
+    finally:
+        info = handler.closeInstance()
+        updateIndex(root, name, fn, info)
+        if (combine or cfg.lookup('instance-logs-combined')):
+            handler.appendFile(fn)
+        log.info('Instance log {}: {} bytes'.format(fn, info['size']))
+
+def findIndex(path):
+    # Accept the build root, its logs directory or the index file itself.
+    for candidate in [ path,
+                       os.path.join(path, indexFile),
+                       indexName(path) ]:
+        if (os.path.isfile(candidate)):
+            return candidate
+    return None
+
+def select(index, patterns):
+    # Returns a list of (name, filename, entry) tuples for all instances in
+    # the index, that match any of the given patterns, sorted by name.
+    with FileLock(index, shared = True):
+        data = loadIndex(index)
+    root = os.path.dirname(index)
+    rv = []
+    for name in sorted(data['instances']):
+        if (not any(fnmatch.fnmatch(name, p) for p in patterns)):
+            continue
+        entry = data['instances'][name]
+        rv.append((name, os.path.join(root, entry['log']), entry))
+    return rv
@@ -0,0 +1,55 @@
+import fcntl
+import os
+
+lockDirectory = '.mmh-locks'
+
+def lockName(path):
+    # Lock files live in a hidden directory next to the thing they protect.
+    # That way locking a directory does not change its contents, and all the
+    # locks taken in a directory end up in one place.
+    (d, fn) = os.path.split(os.path.normpath(path))
+    return os.path.join(d, lockDirectory, fn + '.lock')
+
+class FileLock:
+    # Advisory, cross-process lock using flock(2). Shared locks may be held by
+    # any number of readers at once, an exclusive lock excludes everybody else.
+    # Locks are tied to the open file, so threads of the same process exclude
+    # each other as well.
+    def __init__(self, path, shared = False, log = None):
+        self.name = lockName(path)
+        self.shared = shared
+        self.log = log
+        self.fd = None
+
+    def acquire(self):
+        mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        d = os.path.dirname(self.name)
+        if (d != '' and not os.path.exists(d)):
+            os.makedirs(d, exist_ok = True)
+        self.fd = os.open(self.name, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(self.fd, mode | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if (self.log is not None):
+                    self.log.info('Waiting for lock: {}'.format(self.name))
+                fcntl.flock(self.fd, mode)
+        except BaseException:
+            # Interrupted while waiting, or locking failed: Do not leak the
+            # lock file's descriptor.
+            os.close(self.fd)
+            self.fd = None
+            raise
+
+    def release(self):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.release()
+        return False
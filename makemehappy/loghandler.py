@@ -1,18 +1,32 @@
 import os
 import sys
+import tempfile
 
-from logbook.base import NOTSET
+from logbook.base import INFO, NOTSET, LogRecord
 from logbook.handlers import Handler, StreamHandler, FileHandler
+from makemehappy.compression import compressionFormat, CompressedLogWriter
 
 class MMHLogHandler(Handler):
+    # Number of records kept in memory before setFile() is called. Beyond
+    # that, the backlog is moved to a temporary file.
+    backlogLimit = 1000
+
     def __init__(self):
         # While filename is None, log everything to memory. When filename gets
         # set to a string, open that file and start logging to it (beginning
         # with emptying the backlog). If it's set to False, do the same, but
-        # log to stdout.
+        # log to stdout. File names with the extension of a compression format
+        # make the log be written compressed.
         self.filename = None
         self._handler = None
         self.backlog = []
+        self._spill = None
+        self._compressed = None
+        # While an instance log is open, records go there instead of to the
+        # main handler. See openInstance().
+        self._instance = None
+        self._instanceFile = None
+        self._phases = {}
         Handler.__init__(self, NOTSET, None, False)
 
     def setFile(self, fn):
@@ -20,22 +34,136 @@ class MMHLogHandler(Handler):
         if isinstance(self.filename, str):
             if (os.path.exists(self.filename)):
                 os.unlink(self.filename)
-            self._handler = FileHandler(self.filename)
+            if compressionFormat(self.filename) is not None:
+                self._compressed = CompressedLogWriter(self.filename)
+                self._handler = StreamHandler(self._compressed)
+            else:
+                self._handler = FileHandler(self.filename)
         elif isinstance(self.filename, bool):
             self._handler = StreamHandler(sys.stdout)
-        for entry in self.backlog:
-            self.emit(entry)
-        backlog = []
+        self.flushBacklog()
+
+    def writeBatch(self, channel, lines):
+        # Write many lines at INFO level in one go, bypassing per-line record
+        # processing. All lines share the timestamp of a single record, whose
+        # formatted form (without message) serves as the prefix of every line.
+        # Returns False if there is nowhere to write to yet; the caller has to
+        # fall back to logging individual records in that case.
+        handler = self.target()
+        if handler is None:
+            return False
+        record = LogRecord(channel, INFO, '')
+        record.heavy_init()
+        prefix = handler.format(record)
+        text = ''.join([ prefix + line + '\n' for line in lines ])
+        with handler.lock:
+            handler.ensure_stream_is_open()
+            handler.write(text)
+            handler.flush()
+        return True
+
+    def logsToFile(self):
+        return isinstance(self.filename, str)
+
+    def target(self):
+        if self._instance is not None:
+            return self._instance
+        return self._handler
+
+    def openInstance(self, fn):
+        # Start logging to a build instance's own log file.
+        d = os.path.dirname(fn)
+        if (d != '' and not os.path.exists(d)):
+            os.makedirs(d, exist_ok = True)
+        if (os.path.exists(fn)):
+            os.unlink(fn)
+        self._instance = FileHandler(fn)
+        self._instanceFile = fn
+        self._phases = {}
+
+    def markPhase(self, phase):
+        # Remember where in the instance log a build phase starts.
+        if self._instance is None:
+            return
+        with self._instance.lock:
+            self._instance.ensure_stream_is_open()
+            self._instance.flush()
+            self._phases[phase] = self._instance.stream.tell()
+
+    def closeInstance(self):
+        # Stop logging to the instance log, and return its size and the
+        # offsets of the phases within it.
+        handler = self._instance
+        self._instance = None
+        handler.close()
+        return { 'size': os.path.getsize(self._instanceFile),
+                 'phases': self._phases }
+
+    def appendFile(self, fn):
+        # Copy a file, like an instance log, verbatim into the main log.
+        handler = self._handler
+        if handler is None:
+            return
+        with open(fn, encoding = 'utf-8',
+                  errors = 'backslashreplace') as fh, handler.lock:
+            handler.ensure_stream_is_open()
+            while True:
+                chunk = fh.read(1024 * 1024)
+                if (len(chunk) == 0):
+                    break
+                handler.write(chunk)
+            handler.flush()
 
     def close(self):
+        if self._instance is not None:
+            self.closeInstance()
+        if self._spill is not None:
+            self._spill.stream.close()
+            self._spill = None
         if self._handler is not None:
             self._handler.close()
+        if self._compressed is not None:
+            self._compressed.close()
 
     def enqueue(self, record):
+        if self._spill is not None:
+            self._spill.emit(record)
+            return
         self.backlog.append(record)
+        if len(self.backlog) > self.backlogLimit:
+            self.spill()
+
+    def spill(self):
+        # Move the in-memory backlog to a temporary file, which also takes all
+        # further records until there is a real place to log to.
+        fh = tempfile.TemporaryFile(mode = 'w+', encoding = 'utf-8',
+                                    errors = 'backslashreplace')
+        self._spill = StreamHandler(fh)
+        for entry in self.backlog:
+            self._spill.emit(entry)
+        self.backlog = []
+
+    def flushBacklog(self):
+        if self._spill is not None:
+            fh = self._spill.stream
+            self._spill = None
+            fh.seek(0)
+            with self._handler.lock:
+                self._handler.ensure_stream_is_open()
+                while True:
+                    chunk = fh.read(1024 * 1024)
+                    if (len(chunk) == 0):
+                        break
+                    self._handler.write(chunk)
+                self._handler.flush()
+            fh.close()
+        for entry in self.backlog:
+            self.emit(entry)
+        self.backlog = []
 
     def emit(self, record):
-        if self._handler is not None:
-            self._handler.emit(record)
+        handler = self.target()
+        if handler is not None:
+            handler.emit(record)
         else:
             self.enqueue(record)
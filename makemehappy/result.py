@@ -1,10 +1,20 @@
-import bz2
-import gzip
+import csv
+import datetime
+import fnmatch
+import glob
 import json
-import lzma
+import hashlib
+import mmap
+import os
 import re
+import sys
+import time
 
 import itertools as it
+import makemehappy.compression as compression
+import makemehappy.cut as cut
+import makemehappy.events as events
+import makemehappy.instancelog as il
 import makemehappy.utilities as mmh
 
 marker = re.compile(
@@ -17,6 +27,8 @@ s = r'All \d+ builds succeeded\.'
 f = r'\d+ build\(s\) out of \d+ failed\.'
 
 success = re.compile(s)
+counts = re.compile(r'All (\d+) builds succeeded\.|'
+                    + r'(\d+) build\(s\) out of (\d+) failed\.')
 outcome = re.compile(r'(' + s + r'|' + f + r')')
 deperror = re.compile(r'Dependency Evaluation contained errors!')
 error = re.compile(r'^ERROR: ')
@@ -29,6 +41,19 @@ def toolchain_to_category(tc):
         return 'clang'
     return 'gnu'
 
+def instanceToolchain(instance):
+    part = instance.split('/')
+    if len(part) == 4 and part[0] == 'boards':
+        # system-build type board
+        return part[2]
+    elif len(part) == 5 and part[0] == 'zephyr':
+        # system-build type zephyr
+        return part[3]
+    elif len(part) == 6 and (part[0] == 'zephyr' or part[0] == 'cmake'):
+        # module build
+        return part[3]
+    return None
+
 # Data types being produced by scanners
 
 def inc2dict(inc):
@@ -39,56 +64,90 @@ def inc2dict(inc):
         'column':    inc.column,
         'category':  inc.category,
         'text':      inc.text,
-        'data':      inc.data,
+        'data':      [],
     }
 
-class Information:
-    def __init__(self):
-        self.data = []
-
-    def push(self, line):
-        return self.data.append(line)
+class CompilerIncident:
+    # Logs of large builds contain a lot of incidents, most of them repeated.
+    # These are kept small, and the key, that identifies an incident, is put
+    # together only once.
+    __slots__ = ('kind', 'fname', 'line', 'column', 'category', 'text', 'key')
 
-class CompilerIncident(Information):
     def __init__(self, kind = None, fname = None,
                  line = None, column = None,
                  category = None, text = ""):
-        super().__init__()
         self.kind = kind
         self.fname = fname
         self.line = line
         self.column = column
         self.category = category
         self.text = text
+        self.key = (kind, fname, line, column, category, text)
 
     def __hash__(self):
-        rep = ""
-        if self.kind is not None:
-            rep += self.kind
-        if self.fname is not None:
-            rep += self.fname
-        if self.line is not None:
-            rep += str(self.line)
-        if self.column is not None:
-            rep += str(self.column)
-        if self.category is not None:
-            rep += self.category
-        if self.text is not None:
-            rep += self.text
-
-        return hash(rep)
+        return hash(self.key)
 
     def __eq__(self, other):
-        return (self.kind     == other.kind     and
-                self.fname    == other.fname    and
-                self.line     == other.line     and
-                self.column   == other.column   and
-                self.category == other.category and
-                self.text     == other.text)
+        return (self.key == other.key)
 
     def __lt__(self, other):
         return (self.fname < other.fname)
 
+class IncidentTable:
+    # Unique incidents, in the order they were found first, along with the
+    # number of times each of them was seen and the build instances it was
+    # seen in. Duplicates are dropped as they are added, so memory use depends
+    # on the number of unique incidents only.
+    def __init__(self):
+        self.entries = {}
+
+    def entry(self, key, incident = None):
+        rv = self.entries.get(key)
+        if rv is None:
+            if incident is None:
+                incident = CompilerIncident(*key)
+            rv = self.entries[key] = [ incident, 0, set() ]
+        return rv
+
+    def add(self, incident, instance = None):
+        # Returns True if the incident was not part of the table before.
+        entry = self.entry(incident.key, incident)
+        entry[1] += 1
+        if instance is not None:
+            entry[2].add(instance)
+        return (entry[1] == 1)
+
+    def pack(self):
+        # Plain tuples are a lot cheaper to transfer between processes than
+        # pickled objects.
+        return [ (key, count, tuple(instances))
+                 for (key, (incident, count, instances))
+                 in self.entries.items() ]
+
+    def merge(self, packed):
+        for (key, count, instances) in packed:
+            entry = self.entry(key)
+            entry[1] += count
+            entry[2].update(instances)
+
+    def count(self, incident):
+        return self.entries[incident.key][1]
+
+    def instances(self, incident):
+        return sorted(self.entries[incident.key][2])
+
+    def describe(self, incident):
+        rv = inc2dict(incident)
+        rv['count'] = self.count(incident)
+        rv['instances'] = self.instances(incident)
+        return rv
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return (entry[0] for entry in self.entries.values())
+
 # Scanner state
 
 class ScannerState:
@@ -99,8 +158,39 @@ class ScannerState:
         self.scanners = scanners
         self.name = 'prologue'
         self.toolchain = None
+        self.instance = None
+        self.phase = None
         self.current = None
-        self.active = scanners['always']
+        self.filters = {}
+        self.activate('always', scanners['always'])
+
+    def activate(self, key, scanners):
+        # Most lines of a log are of no interest to any scanner. To find those
+        # quickly, the expressions of all active scanners are combined into a
+        # single alternation, which is compiled once per set of scanners. In
+        # front of that, there is a test for substrings, one of which has to
+        # be part of a line for any of the scanners to match it.
+        self.active = scanners
+        if key not in self.filters:
+            regex = re.compile('|'.join('(?:' + s.regex.pattern + ')'
+                                        for s in scanners))
+            prefilter = []
+            for s in scanners:
+                if s.prefilter is None:
+                    prefilter = None
+                    break
+                prefilter.extend(s.prefilter)
+            self.filters[key] = (regex, prefilter)
+        (self.filter, self.prefilter) = self.filters[key]
+
+    def interesting(self, line):
+        if self.prefilter is not None:
+            for p in self.prefilter:
+                if p in line:
+                    break
+            else:
+                return False
+        return self.filter.match(line) is not None
 
     def updatePhase(self, phase, toolchain):
         self.name = 'active'
@@ -108,10 +198,11 @@ class ScannerState:
         category = toolchain_to_category(toolchain)
 
         if phase == 'compile' and category in self.scanners['toolchain']:
-            self.active = ([self.scanners['toolchain'][category]] +
-                           self.scanners['always'])
+            self.activate(category,
+                          [self.scanners['toolchain'][category]] +
+                          self.scanners['always'])
         else:
-            self.active = self.scanners['always']
+            self.activate('always', self.scanners['always'])
 
     def reset(self):
         self.current = None
@@ -119,15 +210,38 @@ class ScannerState:
     def finish(self):
         self.name = 'epilogue'
 
+    def save(self):
+        # The active scanners follow from phase and toolchain, so these are
+        # enough to restore the state later. A scanner, that is in the middle
+        # of a multi-line incident, is not saved.
+        return { 'name':      self.name,
+                 'toolchain': self.toolchain,
+                 'instance':  self.instance,
+                 'phase':     self.phase }
+
+    def restore(self, data):
+        self.instance = data['instance']
+        self.phase = data['phase']
+        if data['toolchain'] is not None:
+            self.updatePhase(data['phase'], data['toolchain'])
+        self.name = data['name']
+
 # Scanner types
 
 class Scanner:
+    # Substrings, one of which must be part of any line the scanner's regular
+    # expression matches. None disables this kind of filtering.
+    prefilter = None
+    # A regular expression, that finds part of every line the scanner matches,
+    # anywhere in the line. This is used to search memory mapped logs.
+    signature = None
+
     def __init__(self, regex):
         self.regex = re.compile(regex)
         self.result = None
 
     def match(self, line):
-        return re.match(self.regex, line)
+        return self.regex.match(line)
 
     def process(self, state, matchData, line):
         return state
@@ -139,31 +253,28 @@ class Scanner:
         return False
 
 class ResultTableScanner(Scanner):
+    prefilter = [ 'Build Summary:' ]
+    signature = r'Build Summary:'
     def __init__(self):
         Scanner.__init__(self, r'^Build Summary:$')
     def process(self, state, matchData, line):
         state.finish()
 
 class PhaseScanner(Scanner):
+    prefilter = [ 'Phase: ' ]
+    signature = r'Phase: '
     def __init__(self):
         Scanner.__init__(self, r'^Phase: (([.a-zA-Z0-9+_@-]+/)+[.a-zA-Z0-9+_@-]+): ([.a-zA-Z0-9+_@-]+)$')
     def process(self, state, matchData, line):
-        part = matchData.group(1).split('/')
-        phase = matchData.group(3)
-        tc = None
-        if len(part) == 4 and part[0] == 'boards':
-            # system-build type board
-            tc = part[2]
-        elif len(part) == 5 and part[0] == 'zephyr':
-            # system-build type zephyr
-            tc = part[3]
-        elif len(part) == 6 and (part[0] == 'zephyr' or part[0] == 'cmake'):
-            # module build
-            tc = part[3]
+        state.instance = matchData.group(1)
+        state.phase = phase = matchData.group(3)
+        tc = instanceToolchain(state.instance)
         if tc is not None:
             state.updatePhase(phase, tc)
 
 class TexasInstrumentsCompilerScanner(Scanner):
+    prefilter = [ '", line ' ]
+    signature = r'", line [0-9]+: '
     def __init__(self):
         Scanner.__init__(self, r'^"([^"]+)", line ([0-9]+): ([ a-z]+): (.*)$')
     def process(self, state, matchData, line):
@@ -171,14 +282,14 @@ class TexasInstrumentsCompilerScanner(Scanner):
         self.result = CompilerIncident(kind, fname, line, None, None, desc)
 
 class GnuCompilerScanner(Scanner):
+    prefilter = [ ': ' ]
+    signature = r': [a-z]+: '
     def __init__(self):
-        Scanner.__init__(self, r'^([^:]+):([0-9]+):([0-9]+): ([a-z]+): (.*)$')
+        # The first alternative of the description picks up the warning
+        # category, like [-Wunused-variable], at the end of the line.
+        Scanner.__init__(self, r'^([^:]+):([0-9]+):([0-9]+): ([a-z]+): (.*\[(-W[^]]+)\]|.*)$')
     def process(self, state, matchData, line):
-        (fname, line, column, kind, desc) = matchData.groups()
-        cat = None
-        catm = re.match(r'^.*\[(-W[^]]+)\]$', desc)
-        if catm is not None:
-            cat = catm.group(1)
+        (fname, line, column, kind, desc, cat) = matchData.groups()
         self.result = CompilerIncident(kind, fname, line, column, cat, desc)
 
 
@@ -236,77 +347,722 @@ def scanLine(state, line):
 
     return None
 
-def scan(scanners, fname, accumulate = True):
-    data = []
-    state = ScannerState(scanners)
+def scanLines(state, lines, accumulate = True):
+    data = IncidentTable() if accumulate else []
 
-    # The scan function runs the scanning state machine for every line of
-    # input. This strips some common prefix, and behaves a little different,
-    # depending on whether or not the accumulate bit is active.
-    for line in multiOpen(fname):
+    # This runs the scanning state machine for every line of input. It strips
+    # some common prefix, and behaves a little different, depending on
+    # whether or not the accumulate bit is active: With it, the scanners'
+    # results are collected into an IncidentTable. Without it, the text of
+    # matching lines is collected in a list.
+    for line in lines:
         if state.name == 'epilogue':
             break
-        text = re.sub(strip, '', line)
+        prefix = strip.match(line)
+        text = line if prefix is None else line[prefix.end():]
+        if state.current is None and not state.interesting(text):
+            continue
         result = scanLine(state, text)
-        if result is not None:
-            if accumulate:
-                data.append(result)
-            else:
-                print(text, end = '')
+        if result is None:
+            continue
+        if accumulate:
+            data.add(result, state.instance)
+        else:
+            data.append(text)
+
+    return data
+
+# Plain log files are scanned from memory mapped buffers. Instead of decoding
+# every line, the buffer is searched for the signatures of all scanners. Only
+# lines containing one of those are decoded and handed to the scanning state
+# machine, which decides what they really are. Signatures are searched for
+# separately, because expressions starting with a literal string are found a
+# lot faster than an alternation of them.
+
+def candidateSearches(scanners):
+    # Returns None if any scanner lacks a signature. Every line is a candidate
+    # in that case.
+    lst = scanners['always'] + list(scanners['toolchain'].values())
+    if any(scanner.signature is None for scanner in lst):
+        return None
+    return [ re.compile(signature.encode())
+             for signature in dict.fromkeys(s.signature for s in lst) ]
+
+def lineAt(buf, pos, end):
+    lend = buf.find(b'\n', pos, end)
+    lend = end if lend < 0 else lend + 1
+    raw = buf[pos:lend]
+    if raw.endswith(b'\r\n'):
+        raw = raw[:-2] + b'\n'
+    return (raw.decode(errors = 'replace'), lend)
+
+def nextCandidate(searches, hits, buf, pos, end):
+    # Returns the offset of the line containing the next signature at or after
+    # pos, or None. The hits list remembers where each signature was found
+    # last, with -1 meaning it does not occur again.
+    first = None
+    for (i, expr) in enumerate(searches):
+        hit = hits[i]
+        if hit is None or 0 <= hit < pos:
+            m = expr.search(buf, pos, end)
+            hit = hits[i] = -1 if m is None else m.start()
+        if hit >= 0 and (first is None or hit < first):
+            first = hit
+    if first is None:
+        return None
+    return buf.rfind(b'\n', pos, first) + 1 or pos
+
+def candidateLines(state, searches, buf, pos, end):
+    hits = [ None ] * (0 if searches is None else len(searches))
+    while pos < end:
+        # A scanner, that keeps going for more than one line, needs to see
+        # the following lines, no matter what they look like.
+        if searches is not None and state.current is None:
+            pos = nextCandidate(searches, hits, buf, pos, end)
+            if pos is None:
+                return
+        (line, pos) = lineAt(buf, pos, end)
+        yield line
+
+# Large mappings are scanned in windows of about this size. Pages of windows,
+# that were scanned already, are given back, so all of a large log does not
+# end up in the resident set of the process. Windows end at line boundaries.
+windowSize = 64 * 1024 * 1024
+
+def releaseMapped(buf, start, end):
+    if hasattr(mmap, 'MADV_DONTNEED'):
+        start -= start % mmap.PAGESIZE
+        end -= end % mmap.PAGESIZE
+        if end > start:
+            buf.madvise(mmap.MADV_DONTNEED, start, end - start)
 
-    return data if accumulate else True
+def mappedLines(state, buf, start, end):
+    searches = candidateSearches(state.scanners)
+    pos = start
+    while pos < end:
+        limit = pos + windowSize
+        if limit >= end:
+            wend = end
+        else:
+            nl = buf.find(b'\n', limit, end)
+            wend = end if nl < 0 else nl + 1
+        yield from candidateLines(state, searches, buf, pos, wend)
+        releaseMapped(buf, pos, wend)
+        pos = wend
+
+def scanFile(state, fname, start = 0, end = None, accumulate = True):
+    # Scans a file, or the byte range from start to end of a plain file. An
+    # end of None means the end of the file.
+    if not isSeekable(fname):
+        if start > 0 or end is not None:
+            return scanLines(state, rangeLines(fname, start, end), accumulate)
+        with multiOpen(fname) as fh:
+            return scanLines(state, fh, accumulate)
+    with open(fname, mode = 'rb') as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if size == 0:
+            return IncidentTable() if accumulate else []
+        with mmap.mmap(fh.fileno(), 0, access = mmap.ACCESS_READ) as buf:
+            return scanLines(state,
+                             mappedLines(state, buf, start,
+                                         size if end is None else end),
+                             accumulate)
+
+# Live incident scanning
+#
+# With live-incidents enabled, compiler output is scanned while it is being
+# logged. The build instance, and therefore its toolchain, are known, so
+# there is no need for phase markers. Every incident is written to a file in
+# the instance's build directory, as well as to the event stream, as soon as
+# it is seen for the first time. This needs log-all, without which compiler
+# output does not pass through MakeMeHappy at all.
+
+incidentFile = 'mmh-incidents.jsonl'
+
+class LiveIncidents:
+    def __init__(self, instance, toolchain, fn):
+        self.instance = instance
+        self.fn = fn
+        self.state = ScannerState(resultScanners)
+        self.state.instance = instance
+        self.state.updatePhase('compile', toolchain)
+        self.table = IncidentTable()
+        self.stream = open(fn, mode = 'w', buffering = 1)
+
+    def __call__(self, lines):
+        state = self.state
+        for line in lines:
+            if state.current is None and not state.interesting(line):
+                continue
+            incident = scanLine(state, line)
+            if incident is None:
+                continue
+            if self.table.add(incident, self.instance):
+                record = self.table.describe(incident)
+                self.stream.write(json.dumps(record, sort_keys = True) + '\n')
+                events.emit('incident', instance = self.instance,
+                            incident = record)
+
+    def close(self, log):
+        # With the compiler done, the file is written again, to get the final
+        # counts into it.
+        self.stream.close()
+        with mmh.atomicFile(self.fn) as fh:
+            for incident in self.table:
+                fh.write(json.dumps(self.table.describe(incident),
+                                    sort_keys = True) + '\n')
+        log.info('Found {} unique compiler incident(s) in {}, see {}'
+                 .format(len(self.table), self.instance, self.fn))
+        return self.table
+
+def liveIncidents(cfg, instance, directory):
+    # Returns an observer for loggedProcess(), or None if live incident
+    # scanning is disabled, or the instance's toolchain is unknown.
+    if (not (cfg.lookup('live-incidents') and cfg.lookup('log-all'))):
+        return None
+    toolchain = instanceToolchain(instance)
+    if toolchain is None:
+        return None
+    return LiveIncidents(instance, toolchain,
+                         os.path.join(directory, incidentFile))
+
+def scan(scanners, fname, accumulate = True):
+    state = ScannerState(scanners)
+    data = scanFile(state, fname, accumulate = accumulate)
+    if accumulate:
+        return data
+    for text in data:
+        print(text, end = '')
+    return True
 
 def multiOpen(fn: str):
-    if (fn.endswith('.xz') or fn.endswith('.lzma')):
-        return lzma.open(fn, mode = 'rt')
-    if (fn.endswith('.bz2')):
-        return bz2.open(fn, mode = 'rt')
-    if (fn.endswith('.gz') or fn.endswith('.z')):
-        return gzip.open(fn, mode = 'rt')
-    return open(fn)
+    return compression.openReader(fn)
 
 def printMatches(lst, pattern):
     for line in lst:
         if (re.match(pattern, line)):
             print(line, end = '')
 
+def isSeekable(fn):
+    return (compression.compressionFormat(fn) is None and os.path.isfile(fn))
+
+def decodeLines(data):
+    return data.decode(errors = 'replace').splitlines(keepends = True)
+
+def rangeLines(fname, start = 0, end = None, blockSize = 1024 * 1024):
+    # Yields the lines in a byte range of a log. An end of None means the end
+    # of the log. In compressed logs, offsets refer to the uncompressed data,
+    # and the data in front of start is skipped while decompressing.
+    with compression.openBinaryReader(fname) as fh:
+        fh.seek(start)
+        left = None if end is None else end - start
+        tail = b''
+        while left is None or left > 0:
+            data = fh.read(blockSize if left is None else min(blockSize, left))
+            if len(data) == 0:
+                break
+            if left is not None:
+                left -= len(data)
+            data = tail + data
+            cut = data.rfind(b'\n') + 1
+            tail = data[cut:]
+            yield from decodeLines(data[:cut])
+        if len(tail) > 0:
+            yield from decodeLines(tail)
+
+def findLastMarker(fh, size, blockSize = 1024 * 1024):
+    # Search a log file backwards, block by block, for the last line matching
+    # the marker expression. Returns the offset of that line, or None. Only
+    # lines that contain the tail of the marker are looked at in detail.
+    pos = size
+    tail = b''
+    while pos > 0:
+        start = max(0, pos - blockSize)
+        fh.seek(start)
+        block = fh.read(pos - start) + tail
+        pos = start
+        idx = len(block)
+        while True:
+            idx = block.rfind(b'Summary:', 0, idx)
+            if idx < 0:
+                break
+            lstart = block.rfind(b'\n', 0, idx) + 1
+            if lstart == 0 and start > 0:
+                # The line starts in the previous block.
+                break
+            lend = block.find(b'\n', idx)
+            lend = len(block) if lend < 0 else lend + 1
+            line = block[lstart:lend].decode(errors = 'replace')
+            if marker.match(line):
+                return start + lstart
+        # Carry the partial line at the start of this block over to the next
+        # iteration, so lines spanning block boundaries are seen in one piece.
+        nl = block.find(b'\n')
+        tail = block if nl < 0 else block[:nl]
+    return None
+
+def lastLine(fh, size, blockSize = 64 * 1024):
+    fh.seek(max(0, size - blockSize))
+    lines = decodeLines(fh.read())
+    return lines[-1] if len(lines) > 0 else None
+
+def findTable(fname):
+    # Returns the result table of a log, with the log prefix stripped, and the
+    # last line of the log. Plain logs are searched from the end.
+    table = []
+    lastline = None
+    if not isSeekable(fname):
+        for line in multiOpen(fname):
+            lastline = line
+            if ('Summary:' in line and marker.match(line)):
+                table = [ strip.sub('', line) ]
+            elif (len(table) > 0):
+                table.append(strip.sub('', line))
+        return (table, lastline)
+    with open(fname, mode = 'rb') as fh:
+        size = os.fstat(fh.fileno()).st_size
+        lastline = lastLine(fh, size)
+        offset = findLastMarker(fh, size)
+        if offset is not None:
+            fh.seek(offset)
+            table = [ strip.sub('', line)
+                      for line in decodeLines(fh.read()) ]
+    return (table, lastline)
+
+# Scanning in parallel
+#
+# Many logs, or large ones, can be scanned by a pool of processes. Plain logs
+# are split into chunks, each of which begins at a phase marker line. A chunk
+# is scanned with a fresh ScannerState, which picks up the right toolchain from
+# the marker in its first line, just like scanning the whole file would have
+# at that point. Compressed logs cannot be split and are scanned as a whole.
+
+minimumChunk = 16 * 1024 * 1024
+
+def expandFiles(patterns):
+    # File arguments may be glob patterns, for shells that do not expand them.
+    # A pattern without matches is kept as is, for opening it to report the
+    # actual problem.
+    rv = []
+    for pattern in patterns:
+        if os.path.exists(pattern):
+            matches = [ pattern ]
+        else:
+            matches = sorted(glob.glob(pattern)) or [ pattern ]
+        for fn in matches:
+            if fn not in rv:
+                rv.append(fn)
+    return rv
+
+def markerLines(buf, literal, end):
+    # Yields the offset and the text, without log prefix, of every line in
+    # buf[:end] that contains literal.
+    idx = buf.find(literal, 0, end)
+    while idx >= 0:
+        lstart = buf.rfind(b'\n', 0, idx) + 1
+        lend = buf.find(b'\n', idx, end)
+        lend = end if lend < 0 else lend + 1
+        line = buf[lstart:lend].decode(errors = 'replace')
+        prefix = strip.match(line)
+        yield (lstart, line if prefix is None else line[prefix.end():])
+        idx = buf.find(literal, lend, end)
+
+def phaseMarkers(fname):
+    # Returns the offsets of all phase marker lines in a plain log file.
+    scanner = PhaseScanner()
+    rv = []
+    with open(fname, mode = 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return rv
+        with mmap.mmap(fh.fileno(), 0, access = mmap.ACCESS_READ) as buf:
+            for (offset, text) in markerLines(buf, b'Phase: ', len(buf)):
+                if scanner.match(text) is not None:
+                    rv.append(offset)
+    return rv
+
+def splitLog(fname, parts):
+    # Returns a list of (start, end) byte ranges, that cover the file. An end
+    # of None means the end of the file.
+    size = os.path.getsize(fname)
+    if parts < 2 or size < 2 * minimumChunk:
+        return [ (0, None) ]
+    target = max(minimumChunk, size // parts)
+    bounds = [ 0 ]
+    for offset in phaseMarkers(fname):
+        if offset - bounds[-1] >= target:
+            bounds.append(offset)
+    return list(zip(bounds, bounds[1:] + [ None ]))
+
+def scanJob(job):
+    # Runs in a worker process. Returns the scan results and whether the scan
+    # ran into the result table, which ends the part of the log of interest.
+    (fname, start, end, accumulate) = job
+    state = ScannerState(resultScanners)
+    data = scanFile(state, fname, start, end, accumulate)
+    if accumulate:
+        data = data.pack()
+    return (data, state.name == 'epilogue')
+
+def scanFiles(files, accumulate = True, jobs = 1):
+    # Returns an IncidentTable of the incidents found in all files, or a list
+    # of the text of all lines the scanners matched, if accumulate is False.
+    # More processes than processors only add overhead.
+    jobs = min(jobs, os.cpu_count() or 1)
+    work = []
+    for fname in files:
+        if jobs > 1 and isSeekable(fname):
+            ranges = splitLog(fname, 4 * jobs)
+        else:
+            ranges = [ (0, None) ]
+        work.extend((fname, start, end, accumulate) for (start, end) in ranges)
+    return scanWork(work, accumulate, jobs)
+
+def scanWork(work, accumulate = True, jobs = 1):
+    # Scans a list of (fname, start, end, accumulate) jobs, and combines their
+    # results like scanFiles() does.
+    jobs = min(jobs, os.cpu_count() or 1)
+    if jobs > 1 and len(work) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers = jobs) as pool:
+            results = list(pool.map(scanJob, work))
+    else:
+        results = map(scanJob, work)
+
+    # Results are combined in the order of the input. Once a chunk of a file
+    # has reached the result table, the chunks following it are ignored, as
+    # scanning the file in one piece would have stopped there as well.
+    data = IncidentTable() if accumulate else []
+    finished = set()
+    for (job, (chunk, done)) in zip(work, results):
+        fname = job[0]
+        if fname in finished:
+            continue
+        if accumulate:
+            data.merge(chunk)
+        else:
+            data.extend(chunk)
+        if done:
+            finished.add(fname)
+    return data
+
+# Following growing logs
+#
+# With --incremental, scanning a plain log starts where the previous scan of
+# the same log ended. A checkpoint file next to the log stores that offset,
+# along with the scanner state and the incidents seen so far. Only new
+# incidents, and the phases they appear in, are shown. With --follow, this
+# is repeated until the log's result table shows up.
+
+followInterval = 1
+
+def sidecarName(fn, suffix):
+    (d, name) = os.path.split(os.path.abspath(fn))
+    return os.path.join(d, '.' + name + suffix)
+
+class Follower:
+    def __init__(self, cfg, args, fname):
+        self.cfg = cfg
+        self.args = args
+        self.fname = fname
+        self.checkpoint = sidecarName(fname, '.mmh-scan')
+        self.reset()
+        self.load()
+
+    def reset(self):
+        self.offset = 0
+        self.inode = None
+        self.state = ScannerState(resultScanners)
+        self.table = IncidentTable()
+
+    def load(self):
+        if (not os.path.isfile(self.checkpoint)):
+            return
+        with open(self.checkpoint) as fh:
+            data = json.load(fh)
+        self.offset = data['offset']
+        self.inode = data['inode']
+        self.state.restore(data['state'])
+        self.table.merge((tuple(key), count, instances)
+                         for (key, count, instances) in data['incidents'])
+
+    def save(self):
+        data = { 'offset':    self.offset,
+                 'inode':     self.inode,
+                 'state':     self.state.save(),
+                 'incidents': self.table.pack() }
+        with mmh.atomicFile(self.checkpoint) as fh:
+            json.dump(data, fh)
+
+    def show(self, incident):
+        if self.args.json_incidents:
+            print(json.dumps(self.table.describe(incident), sort_keys = True))
+        elif incident.column is not None:
+            print(f'{incident.fname}:{incident.line}:{incident.column}: '
+                  + f'{incident.kind}: {incident.text}')
+        else:
+            print(f'{incident.fname}:{incident.line}: '
+                  + f'{incident.kind}: {incident.text}')
+
+    def poll(self):
+        # Scans everything appended to the log since the last call, up to
+        # the last complete line. Returns True once the result table was
+        # reached.
+        st = os.stat(self.fname)
+        if (st.st_ino != self.inode or st.st_size < self.offset):
+            # The log was replaced or truncated. Start over.
+            self.reset()
+            self.inode = st.st_ino
+        if (self.state.name == 'epilogue'):
+            return True
+        if (st.st_size == self.offset):
+            return False
+
+        state = self.state
+        with open(self.fname, mode = 'rb') as fh:
+            with mmap.mmap(fh.fileno(), 0, access = mmap.ACCESS_READ) as buf:
+                end = buf.rfind(b'\n', self.offset) + 1
+                if end <= self.offset:
+                    return False
+                phase = (state.instance, state.phase)
+                for line in mappedLines(state, buf, self.offset, end):
+                    prefix = strip.match(line)
+                    text = line if prefix is None else line[prefix.end():]
+                    if (state.current is None
+                            and not state.interesting(text)):
+                        continue
+                    incident = scanLine(state, text)
+                    if (state.name == 'epilogue'):
+                        break
+                    if ((state.instance, state.phase) != phase):
+                        phase = (state.instance, state.phase)
+                        if not self.args.json_incidents:
+                            print(f'Phase: {state.instance}: {state.phase}')
+                    if (incident is not None
+                            and self.table.add(incident, state.instance)):
+                        self.show(incident)
+        self.offset = end
+        self.save()
+        return (state.name == 'epilogue')
+
+    def finish(self):
+        # Once the log is complete, show its result table the usual way.
+        if self.args.json_incidents:
+            return True
+        result = Result(self.cfg, self.args, self.fname)
+        result.run()
+        return result.result
+
+    def run(self, follow):
+        try:
+            while not self.poll():
+                if not follow:
+                    return True
+                sys.stdout.flush()
+                time.sleep(followInterval)
+        except KeyboardInterrupt:
+            return True
+        return self.finish()
+
+def follow(cfg, args, files):
+    if (args.follow_result and len(files) > 1):
+        print('Only a single log can be followed.')
+        return False
+    for fn in files:
+        if (not isSeekable(fn)):
+            print('Only plain log files can be scanned incrementally: {}'
+                  .format(fn))
+            return False
+    rv = True
+    for fn in files:
+        rv = Follower(cfg, args, fn).run(args.follow_result) and rv
+    return rv
+
+# Phase index
+#
+# With --instance and a log file, instead of a build root, only the output of
+# the matching instances is read from the log, and with --phase only that of
+# the given phases. An index of the phase marker lines in the log is kept next
+# to it (.NAME.mmh-phases), so these are found without reading the log. The
+# index is derived from the log the first time it is needed, and again after
+# the log changed. Offsets in compressed logs refer to the uncompressed data;
+# the output in front of a phase is skipped over while decompressing, without
+# looking at its lines.
+
+def readMarkers(fh, blockSize = 4 * 1024 * 1024):
+    # Reads a log from a binary stream. Returns its phase markers as a list of
+    # (offset, instance, phase) tuples, as well as the offset, at which the
+    # output of the last phase ends: That of the result table, or the end of
+    # the log.
+    phase = PhaseScanner()
+    summary = ResultTableScanner()
+    markers = []
+    pos = 0
+    tail = b''
+    while True:
+        data = fh.read(blockSize)
+        block = tail + data
+        cut = len(block) if len(data) == 0 else block.rfind(b'\n') + 1
+        end = cut
+        for (offset, text) in markerLines(block, b'Build Summary:', cut):
+            if summary.match(text) is not None:
+                end = offset
+                break
+        for (offset, text) in markerLines(block, b'Phase: ', end):
+            m = phase.match(text)
+            if m is not None:
+                markers.append((pos + offset, m.group(1), m.group(3)))
+        if end < cut or len(data) == 0:
+            return (markers, pos + end)
+        pos += cut
+        tail = block[cut:]
+
+def phaseIndex(fname):
+    # Returns the phase index of a log, from its sidecar file if that is up
+    # to date. Otherwise the index is read from the log and saved for next
+    # time, if the log's directory can be written to.
+    st = os.stat(fname)
+    stamp = [ st.st_size, st.st_mtime_ns, st.st_ino ]
+    fn = sidecarName(fname, '.mmh-phases')
+    if os.path.isfile(fn):
+        with open(fn) as fh:
+            data = json.load(fh)
+        if data['stamp'] == stamp:
+            return data
+    with compression.openBinaryReader(fname) as fh:
+        (markers, end) = readMarkers(fh)
+    data = { 'stamp': stamp, 'end': end, 'phases': markers }
+    try:
+        with mmh.atomicFile(fn) as fh:
+            json.dump(data, fh)
+    except OSError:
+        pass
+    return data
+
+def selectPhases(phases, end, patterns, wanted):
+    # Takes a list of (offset, instance, phase) tuples, sorted by offset.
+    # Returns the (instance, phase, start, end) tuples of those, whose instance
+    # matches any of the patterns, and whose phase is wanted. An empty list of
+    # wanted phases means all of them.
+    rv = []
+    for (n, (offset, instance, phase)) in enumerate(phases):
+        if (not any(fnmatch.fnmatch(instance, p) for p in patterns)):
+            continue
+        if (len(wanted) > 0 and phase not in wanted):
+            continue
+        stop = phases[n + 1][0] if n + 1 < len(phases) else end
+        rv.append((instance, phase, offset, stop))
+    return rv
+
+def instanceSections(index, args):
+    # Returns (title, fname, start, end) tuples for the instance logs of a
+    # build root, that match the --instance patterns.
+    rv = []
+    for (name, logfile, entry) in il.select(index, args.result_instances):
+        if (len(args.result_phases) == 0):
+            rv.append(('Instance {} ({} bytes): {}'
+                       .format(name, entry['size'], logfile),
+                       logfile, 0, None))
+            continue
+        phases = sorted((offset, name, phase)
+                        for (phase, offset) in entry['phases'].items())
+        for (instance, phase, start, end) in selectPhases(
+                phases, entry['size'], [ name ], args.result_phases):
+            rv.append(('Instance {}, phase {} ({} bytes): {}'
+                       .format(name, phase, end - start, logfile),
+                       logfile, start, end))
+    return rv
+
+def logSections(fname, args):
+    # Like instanceSections(), but for the output of the matching instances
+    # within a log file.
+    data = phaseIndex(fname)
+    return [ ('Instance {}, phase {} ({} bytes): {}'
+              .format(instance, phase, end - start, fname),
+              fname, start, end)
+             for (instance, phase, start, end)
+             in selectPhases(data['phases'], data['end'],
+                             args.result_instances, args.result_phases) ]
+
+def scanReport(args, files):
+    if (args.report_incidents or args.json_incidents):
+        # --report, --json
+        table = scanFiles(files, jobs = args.jobs)
+        return reportIncidents(args, table)
+    # --grep
+    for text in scanFiles(files, accumulate = False, jobs = args.jobs):
+        print(text, end = '')
+    return True
+
 class Result:
-    def __init__(self, cfg, args):
+    def __init__(self, cfg, args, input):
         self.cfg = cfg
         self.args = args
+        self.input = input
         self.result = False
 
-    def run(self):
-        input = self.args.file[0]
+    def scanReverse(self, input):
+        # For plain files, the result table is found starting at the end of
+        # the log, without reading the build output in front of it. ERROR
+        # markers are left to be found later, if they are needed.
+        (table, lastline) = findTable(input)
+        return (table, lastline, None)
+
+    def scanForward(self, input):
+        # Compressed logs can only be read from the front. Do it once, and
+        # collect ERROR markers along with the result table.
         table = []
+        errors = []
         lastline = None
 
         for line in multiOpen(input):
             lastline = line
-            if (re.match(marker, line)):
-                entry = re.sub(strip, '', line)
-                table = [ entry ]
+            if ('Summary:' in line and marker.match(line)):
+                table = [ strip.sub('', line) ]
             elif (len(table) > 0):
-                entry = re.sub(strip, '', line)
-                table += [ entry ]
+                table.append(strip.sub('', line))
+            elif ('ERROR: ' in line):
+                entry = stripSome.sub('', line)
+                if (error.match(entry)):
+                    errors.append(entry)
             if (self.args.full_result and len(table) == 0):
-                stripped = re.sub(strip, '', line)
+                stripped = strip.sub('', line)
                 print(stripped, end='')
 
-        lastline = re.sub(strip, '', lastline)
-        if (re.match(nobuild, lastline)):
-            print(lastline, end = '')
-            self.result = True
-            return
+        return (table, lastline, errors)
+
+    def scanErrors(self, input):
+        errors = []
+        for line in multiOpen(input):
+            if ('ERROR: ' not in line):
+                continue
+            entry = stripSome.sub('', line)
+            if (error.match(entry)):
+                errors.append(entry)
+        return errors
+
+    def run(self):
+        input = self.input
+
+        if (self.args.full_result == False and isSeekable(input)):
+            (table, lastline, errors) = self.scanReverse(input)
+        else:
+            (table, lastline, errors) = self.scanForward(input)
+
+        if (lastline is not None):
+            lastline = re.sub(strip, '', lastline)
+            if (re.match(nobuild, lastline)):
+                print(lastline, end = '')
+                self.result = True
+                return
 
         if (len(table) < 2):
             if (self.args.quiet_result == False):
                 print('Could not find result table in log: {}'.format(input))
                 print('Scanning for ERROR markers:')
-                for line in multiOpen(input):
-                    entry = re.sub(stripSome, '', line)
-                    if (re.match(error, entry)):
-                        print(entry, end = '')
+                if errors is None:
+                    errors = self.scanErrors(input)
+                for entry in errors:
+                    print(entry, end = '')
             self.result = False
             return
 
@@ -328,43 +1084,387 @@ class Result:
 
         self.result = (buildSuccess and depSuccess)
 
-def show(cfg, args):
-    if (args.report_incidents or args.json_incidents or args.grep_result):
-        logfile = args.file[0]
-        if (args.report_incidents or args.json_incidents):
-            # --report, --json
-            uniq = set(scan(resultScanners, logfile))
-            if args.json_incidents:
-                data = list(map(inc2dict, uniq))
-                print(json.dumps(data, sort_keys = True, indent = 4))
-                return True
-            data = it.groupby(sorted(uniq),
-                              key = lambda x: x.fname)
-            for piece in data:
-                (fname, lst) = piece
-                print(f'Incidents for {fname}:')
-                for inc in sorted(lst, key = lambda x: x.line):
-                    if inc.column is not None:
-                        print(f'  {inc.line}:{inc.column}: {inc.kind}: {inc.text}')
-                    else:
-                        print(f'  {inc.line}: {inc.kind}: {inc.text}')
-
-            n = len(uniq)
-            if n == 0:
-                print(f'No compiler incidents found.')
-                return True
+def reportIncidents(args, uniq):
+    if args.json_incidents:
+        data = list(map(uniq.describe, uniq))
+        print(json.dumps(data, sort_keys = True, indent = 4))
+        return True
+    data = it.groupby(sorted(uniq),
+                      key = lambda x: x.fname)
+    for piece in data:
+        (fname, lst) = piece
+        print(f'Incidents for {fname}:')
+        for inc in sorted(lst, key = lambda x: x.line):
+            if inc.column is not None:
+                print(f'  {inc.line}:{inc.column}: {inc.kind}: {inc.text}')
             else:
-                print(f'\nFound {n} compiler incident(s).')
+                print(f'  {inc.line}: {inc.kind}: {inc.text}')
+
+    n = len(uniq)
+    if n == 0:
+        print(f'No compiler incidents found.')
+        return True
+    else:
+        print(f'\nFound {n} compiler incident(s).')
+        return False
+
+def showInstances(cfg, args):
+    # With --instance, the file arguments name build roots with instance logs,
+    # or log files. Only the output of the matching instances is looked at,
+    # and with --phase only that of the given phases.
+    sections = []
+    for fn in expandFiles(args.file):
+        if (os.path.isdir(fn) or os.path.basename(fn) == il.indexFile):
+            index = il.findIndex(fn)
+            if index is None:
+                print('No instance log index found in: {}'.format(fn))
                 return False
-        # --grep
-        return scan(resultScanners, logfile, accumulate = False)
+            sections.extend(instanceSections(index, args))
+        else:
+            sections.extend(logSections(fn, args))
+    if len(sections) == 0:
+        print('No output of instances matching {} found.'
+              .format(', '.join(args.result_instances)))
+        return False
+
+    if (args.report_incidents or args.json_incidents or args.grep_result):
+        accumulate = not args.grep_result
+        data = scanWork([ (fname, start, end, accumulate)
+                          for (title, fname, start, end) in sections ],
+                        accumulate, args.jobs)
+        if accumulate:
+            return reportIncidents(args, data)
+        for text in data:
+            print(text, end = '')
+        return True
 
-    # Other options showing result tables and such.
-    result = Result(cfg, args)
+    def thunk():
+        for (title, fname, start, end) in sections:
+            if (args.quiet_result == False):
+                print(title)
+                for line in rangeLines(fname, start, end):
+                    print(re.sub(strip, '', line), end = '')
 
     if (cfg.lookup('page-output')):
-        mmh.pager(cfg, result.run)
+        mmh.pager(cfg, thunk)
     else:
-        result.run()
+        thunk()
+    return True
+
+class EventResult:
+    # Like Result, but working from a JSON-lines event file, written using
+    # --events. This does not need to look at compiler output at all.
+    def __init__(self, cfg, log, args, input):
+        self.cfg = cfg
+        self.log = log
+        self.args = args
+        self.input = input
+        self.result = False
+
+    def run(self):
+        input = self.input
+        try:
+            (data, final) = events.loadStatistics(input)
+        except events.InvalidEventFile as e:
+            print('Not an event file: {}'.format(e))
+            self.result = False
+            return
+        if (len(data) == 0 and final is None):
+            if (self.args.quiet_result == False):
+                print('Could not find build statistics in events: {}'
+                      .format(input))
+            self.result = False
+            return
+
+        stats = cut.ExecutionStatistics(self.cfg, self.log)
+        stats.data = data
+        if final is None:
+            final = { 'success': stats.wasSuccessful(),
+                      'builds': stats.countBuilds(),
+                      'failed': stats.countFailed(),
+                      'dependencies': True }
+
+        lst = []
+        if final['success']:
+            lst.append('All {} builds succeeded.'.format(final['builds']))
+        else:
+            lst.append('{} build(s) out of {} failed.'
+                       .format(final['failed'], final['builds']))
+        if (not final['dependencies']):
+            lst.append('Dependency Evaluation contained errors!')
+
+        if (self.args.quiet_result == False):
+            if (self.args.short_result == False and len(data) > 0):
+                stats.renderStatistics()
+            for line in lst:
+                print(line)
+
+        depSuccess = True
+        if (self.cfg.lookup('fatal-dependencies')):
+            depSuccess = final['dependencies']
+        self.result = (final['success'] and depSuccess)
+
+# Aggregating results
+#
+# With --aggregate, show-result summarises the results of many logs, like the
+# ones a CI system keeps, in a single table. Directories are searched for logs
+# and event files. These are read by a pool of processes, and their summaries
+# are cached, keyed by path, size and modification time. Running it again
+# only reads the logs, that are new or changed since.
+#
+# The cache is split into one file per directory of logs, so a run only
+# rewrites the parts of the cache for directories, that changed. Entries for
+# logs, that were removed, are dropped along the way.
+
+aggregateCache = 'aggregate'
+aggregateVersion = 2
+aggregateFields = [ 'file', 'time', 'size', 'status', 'builds', 'failed',
+                    'dependency-errors', 'result' ]
+
+def isLogFile(fn):
+    name = os.path.basename(fn)
+    if (name.startswith('.') or name == incidentFile):
+        return False
+    return (compression.plainName(name).endswith('.log')
+            or events.isEventFile(name))
+
+def findLogs(paths):
+    rv = []
+    for path in expandFiles(paths):
+        if (not os.path.isdir(path)):
+            rv.append(path)
+            continue
+        for (root, dirs, files) in os.walk(path):
+            dirs.sort()
+            rv.extend(os.path.join(root, fn)
+                      for fn in sorted(files) if isLogFile(fn))
+    return rv
+
+def summariseEvents(fname, rv):
+    (data, final) = events.loadStatistics(fname)
+    if (final is None and len(data) > 0):
+        stats = cut.ExecutionStatistics(None, None)
+        stats.data = data
+        final = { 'success': stats.wasSuccessful(),
+                  'builds': stats.countBuilds(),
+                  'failed': stats.countFailed(),
+                  'dependencies': True }
+    if final is None:
+        return rv
+    rv['status'] = 'success' if final['success'] else 'failure'
+    rv['builds'] = final['builds']
+    rv['failed'] = final['failed']
+    rv['dependency-errors'] = not final['dependencies']
+    return rv
+
+def unreadableLog():
+    return { 'status': 'unreadable', 'builds': None, 'failed': None,
+             'dependency-errors': None }
+
+def summariseLog(fname):
+    # Runs in a worker process. Returns what the result table of a log says,
+    # without anything that depends on configuration.
+    rv = { 'status': 'incomplete', 'builds': None, 'failed': None,
+           'dependency-errors': None }
+    try:
+        if events.isEventFile(fname):
+            return summariseEvents(fname, rv)
+        (table, lastline) = findTable(fname)
+    except (OSError, EOFError, ValueError, KeyError, TypeError,
+            events.InvalidEventFile):
+        # Anything, that is not a log or event file mmh wrote, is reported
+        # as unreadable, without stopping the aggregation.
+        return unreadableLog()
+
+    if (lastline is not None and nobuild.match(strip.sub('', lastline))):
+        rv['status'] = 'nobuild'
+        return rv
+    if (len(table) < 2):
+        return rv
+    lst = table[-2:]
+    rv['dependency-errors'] = any(deperror.match(line) for line in lst)
+    for line in lst:
+        m = counts.match(line)
+        if m is None:
+            continue
+        if m.group(1) is not None:
+            rv.update(status = 'success', builds = int(m.group(1)),
+                      failed = 0)
+        else:
+            rv.update(status = 'failure', builds = int(m.group(3)),
+                      failed = int(m.group(2)))
+    return rv
+
+def aggregateCacheFile(cachedir, d):
+    digest = hashlib.blake2b(d.encode(), digest_size = 16).hexdigest()
+    return os.path.join(cachedir, digest + '.json')
+
+class AggregateCache:
+    # The summaries of logs, by directory and name within that directory.
+    def __init__(self, cachedir):
+        self.cachedir = cachedir
+        self.shards = {}
+        self.dirty = set()
+
+    def load(self, d):
+        fn = aggregateCacheFile(self.cachedir, d)
+        try:
+            with open(fn) as fh:
+                data = json.load(fh)
+            if (data.get('version') != aggregateVersion
+                    or data.get('directory') != d):
+                return {}
+            logs = data['logs']
+            present = set(os.listdir(d))
+        except (OSError, ValueError, KeyError):
+            return {}
+        for name in [ name for name in logs if name not in present ]:
+            del logs[name]
+            self.dirty.add(d)
+        return logs
+
+    def shard(self, d):
+        if (d not in self.shards):
+            self.shards[d] = {} if self.cachedir is None else self.load(d)
+        return self.shards[d]
+
+    def lookup(self, path, key):
+        # Returns the entry for a log, and whether it has to be read.
+        (d, name) = os.path.split(path)
+        shard = self.shard(d)
+        entry = shard.get(name)
+        if (entry is not None and entry['key'] == key):
+            return (entry, False)
+        entry = shard[name] = { 'key': key, 'summary': None }
+        self.dirty.add(d)
+        return (entry, True)
+
+    def save(self):
+        if (self.cachedir is None):
+            return
+        try:
+            os.makedirs(self.cachedir, exist_ok = True)
+            for d in self.dirty:
+                with mmh.atomicFile(aggregateCacheFile(self.cachedir,
+                                                       d)) as fh:
+                    json.dump({ 'version':   aggregateVersion,
+                                'directory': d,
+                                'logs':      self.shards[d] }, fh)
+        except OSError:
+            pass
+
+def aggregateLogs(files, jobs = 1, cachedir = None):
+    # Returns a list of (fname, stat, summary) tuples for all files. The stat
+    # is None for files, that cannot be accessed at all.
+    cache = AggregateCache(cachedir)
+    rv = []
+    todo = []
+    for fname in files:
+        path = os.path.abspath(fname)
+        try:
+            st = os.stat(path)
+        except OSError:
+            rv.append((fname, None, { 'summary': unreadableLog() }))
+            continue
+        (entry, read) = cache.lookup(path, [ st.st_size, st.st_mtime_ns ])
+        if (read):
+            todo.append((path, entry))
+        rv.append((fname, st, entry))
+
+    jobs = min(jobs, os.cpu_count() or 1)
+    if jobs > 1 and len(todo) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers = jobs) as pool:
+            summaries = list(pool.map(summariseLog,
+                                      [ path for (path, entry) in todo ],
+                                      chunksize = 16))
+    else:
+        summaries = map(summariseLog, [ path for (path, entry) in todo ])
+    for ((path, entry), summary) in zip(todo, summaries):
+        entry['summary'] = summary
+
+    cache.save()
+    return [ (fname, st, entry['summary']) for (fname, st, entry) in rv ]
+
+def aggregate(cfg, args):
+    fatal = cfg.lookup('fatal-dependencies')
+    files = findLogs(args.file)
+    records = []
+    for (fname, st, summary) in aggregateLogs(files, args.jobs,
+                                              mmh.xdgCacheFile(aggregateCache)):
+        record = { 'file': fname, 'time': None, 'size': None }
+        if (st is not None):
+            record['time'] = (datetime.datetime.fromtimestamp(st.st_mtime)
+                                               .isoformat(timespec = 'seconds'))
+            record['size'] = st.st_size
+        record.update(summary)
+        record['result'] = (record['status'] in [ 'success', 'nobuild' ]
+                            and not (fatal and record['dependency-errors']))
+        records.append(record)
+
+    if args.json_incidents:
+        print(json.dumps(records, indent = 4))
+    elif args.csv_result:
+        writer = csv.DictWriter(sys.stdout, fieldnames = aggregateFields)
+        writer.writeheader()
+        writer.writerows(records)
+    else:
+        width = max([ len('Log') ] + [ len(r['file']) for r in records ])
+        print('{:<{}} {:<20} {:<10} {:>7} {:>7} {:<4}'
+              .format('Log', width, 'Time', 'Status', 'Builds', 'Failed',
+                      'Deps'))
+        for r in records:
+            deps = '-' if r['dependency-errors'] is None else (
+                'err' if r['dependency-errors'] else 'ok')
+            print('{:<{}} {:<20} {:<10} {:>7} {:>7} {:<4}'
+                  .format(r['file'], width, r['time'] or '-', r['status'],
+                          '-' if r['builds'] is None else r['builds'],
+                          '-' if r['failed'] is None else r['failed'],
+                          deps))
+        print('\n{} log(s), {} successful.'
+              .format(len(records), sum(1 for r in records if r['result'])))
+    return (len(records) == len(files) and all(r['result'] for r in records))
+
+def show(cfg, args, log = None):
+    if args.aggregate_result:
+        return aggregate(cfg, args)
+
+    if (len(args.result_instances) > 0):
+        return showInstances(cfg, args)
+
+    files = expandFiles(args.file)
+    if (args.follow_result or args.incremental_result):
+        return follow(cfg, args, files)
+
+    scanning = (args.report_incidents or args.json_incidents
+                                      or args.grep_result)
+
+    if (scanning):
+        for fn in files:
+            if (events.isEventFile(fn)):
+                print('Event files do not contain compiler output: {}'
+                      .format(fn))
+                return False
+        return scanReport(args, files)
+
+    # Other options showing result tables and such. Event files are handled
+    # by EventResult, every other file is a log.
+    results = []
+    for fn in files:
+        if (events.isEventFile(fn)):
+            results.append(EventResult(cfg, log, args, fn))
+        else:
+            results.append(Result(cfg, args, fn))
+
+    def thunk():
+        for result in results:
+            if (len(results) > 1 and args.quiet_result == False):
+                print('{}:'.format(result.input))
+            result.run()
+
+    if (cfg.lookup('page-output')):
+        mmh.pager(cfg, thunk)
+    else:
+        thunk()
 
-    return result.result
+    return all(result.result for result in results)
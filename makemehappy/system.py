@@ -4,8 +4,13 @@ import os
 import makemehappy.utilities as mmh
 import makemehappy.cut as cut
 import makemehappy.cmake as c
+import makemehappy.events as events
+import makemehappy.instancelog as il
+import makemehappy.result as result
 import makemehappy.zephyr as z
 
+from makemehappy.lock import FileLock
+
 defaults = { 'build-configs'      : [ 'debug', 'release' ],
              'build-system'       : None,
              'build-tool'         : 'ninja',
@@ -279,7 +284,12 @@ class SystemInstance:
         self.sys.log.info('Compiling system instance: {}'.format(self.desc))
         mmh.maybeShowPhase(self.sys.log, 'compile', self.desc, self.sys.args)
         cmd = c.cmake(['--build', self.instance.builddir ])
-        rc = mmh.loggedProcess(self.sys.cfg, self.sys.log, cmd, self.instance.env)
+        live = result.liveIncidents(self.sys.cfg, self.desc,
+                                    self.instance.builddir)
+        rc = mmh.loggedProcess(self.sys.cfg, self.sys.log, cmd,
+                               self.instance.env, observer = live)
+        if (live is not None):
+            live.close(self.sys.log)
         self.sys.stats.logBuild(rc)
         return (rc == 0)
 
@@ -319,16 +329,22 @@ class SystemInstance:
         rc = mmh.loggedProcess(self.sys.cfg, self.sys.log, cmd, self.instance.env)
         return (rc == 0)
 
+    def capture(self):
+        return il.capture(self.sys.cfg, self.sys.log,
+                          self.sys.buildRoot(), self.desc)
+
     def build(self):
-        return (self.configure() and
-                self.compile()   and
-                self.test()      and
-                self.install())
+        with self.capture():
+            return (self.configure() and
+                    self.compile()   and
+                    self.test()      and
+                    self.install())
 
     def rebuild(self):
-        return (self.compile()   and
-                self.test()      and
-                self.install())
+        with self.capture():
+            return (self.compile()   and
+                    self.test()      and
+                    self.install())
 
 class System:
     def __init__(self, log, version, cfg, args):
@@ -359,7 +375,14 @@ class System:
         return self.args.directory
 
     def setupDirectory(self):
+        # The lock serialises concurrent instances of mmh, that try to set up
+        # or update the same build tree. It lives next to the build directory,
+        # since that might not exist yet.
         d = self.args.directory
+        with FileLock(d, log = self.log):
+            self.setupDirectoryLocked(d)
+
+    def setupDirectoryLocked(self, d):
         if (os.path.exists(d)):
             self.log.info('Build directory {} exists: Examining...'.format(d))
             state = os.path.join(d, 'MakeMeHappy.yaml')
@@ -456,6 +479,10 @@ class System:
     def showStats(self):
         self.stats.checkpoint('finish')
         self.stats.renderStatistics()
+        events.emit('result', success = self.stats.wasSuccessful(),
+                    builds = self.stats.countBuilds(),
+                    failed = self.stats.countFailed(),
+                    dependencies = True)
         if self.stats.wasSuccessful():
             self.log.info('All {} builds succeeded.'.format(
                 self.stats.countBuilds()))
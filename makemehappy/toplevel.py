@@ -1,6 +1,7 @@
-import mako.template as mako
 import re
 
+import makemehappy.utilities as mmh
+
 defaultCMakeVersion = "3.12.0"
 defaultProjectName = "MakeMeHappy"
 defaultLanguages = "C CXX ASM"
@@ -82,10 +83,8 @@ class Toplevel:
                 'Deprecated inclusion clause: "{}", use "{}" instead!'
                 .format(inc, new))
             inc = new
-        exp = mako.Template(inc).render(
-            moduleroot = moduleroot,
-            cmake = cmakeVariable)
-        return exp
+        return mmh.renderTemplate(inc, moduleroot = moduleroot,
+                                  cmake = cmakeVariable)
 
     def insertTemplate(self, fh, name, tp, variants, section, default = None):
         realname = name
@@ -1,15 +1,18 @@
 from __future__ import print_function
 
+import contextlib
 import fnmatch
+import functools
+import hashlib
 import os
-import pprint
+import pickle
 import re
 import subprocess
 import shlex
 import sys
-import yaml
+import tempfile
 
-import mako.template as mako
+import makemehappy.events as events
 
 def dotFile(fn):
     return os.path.join(os.environ['HOME'], '.makemehappy', fn)
@@ -22,6 +25,14 @@ def xdgFile(fn):
         base = os.path.join(os.environ['HOME'], '.config')
     return os.path.join(base, 'makemehappy', fn)
 
+def xdgCacheFile(fn):
+    key = 'XDG_CACHE_HOME'
+    if key in os.environ:
+        base = os.environ[key]
+    else:
+        base = os.path.join(os.environ['HOME'], '.cache')
+    return os.path.join(base, 'makemehappy', fn)
+
 def warn(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
@@ -49,30 +60,107 @@ def noParameters(args):
             args.cmake          is None and
             len(args.instances) == 0)
 
+# YAML files are parsed with libyaml, if PyYAML was built with it. Parsed data
+# is cached in the XDG cache directory as well, keyed by the path of the file,
+# its size, modification time and a digest of its contents. Every mmh run loads
+# the same configuration, source and module files, which this way need to be
+# parsed only once after they changed. Setting MMH_YAML_CACHE to 0 disables
+# the cache. With all files cached, the yaml module is not even imported.
+
+yamlCacheVersion = 1
+
+def parseText(text):
+    import yaml
+    return yaml.load(text, Loader = getattr(yaml, 'CSafeLoader',
+                                            yaml.SafeLoader))
+
+def yamlCacheEnabled():
+    return (os.environ.get('MMH_YAML_CACHE', '1') != '0')
+
+def yamlCacheFile(path):
+    digest = hashlib.blake2b(path.encode(), digest_size = 16).hexdigest()
+    return xdgCacheFile(os.path.join('yaml', digest + '.pickle'))
+
+def parseYAML(path):
+    with open(path, mode = 'rb') as fh:
+        text = fh.read()
+        st = os.fstat(fh.fileno())
+    if (not yamlCacheEnabled()):
+        return parseText(text)
+
+    key = (yamlCacheVersion, st.st_size, st.st_mtime_ns,
+           hashlib.blake2b(text).digest())
+    cache = yamlCacheFile(path)
+    try:
+        with open(cache, mode = 'rb') as fh:
+            (cached, data) = pickle.load(fh)
+        if cached == key:
+            return data
+    except Exception:
+        # Missing, outdated or broken cache entries are just replaced.
+        pass
+
+    data = parseText(text)
+    try:
+        os.makedirs(os.path.dirname(cache), exist_ok = True)
+        with atomicFile(cache, mode = 'wb') as fh:
+            pickle.dump((key, data), fh, protocol = pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass
+    return data
+
 def load(file):
-    (root, fn) = os.path.split(os.path.realpath(file))
-    with open(file) as fh:
-        data = yaml.safe_load(fh.read())
-        if data is None:
-            data = {}
-        data['root'] = root
-        data['definition'] = fn
-        return data
+    path = os.path.realpath(file)
+    (root, fn) = os.path.split(path)
+    data = parseYAML(path)
+    if data is None:
+        data = {}
+    data['root'] = root
+    data['definition'] = fn
+    return data
+
+# The process umask can only be read by setting it. Do that once, so files
+# written by atomicFile() get the same permissions as with plain open().
+umask = os.umask(0)
+os.umask(umask)
+
+@contextlib.contextmanager
+def atomicFile(file, mode = 'w'):
+    # Write to a temporary file next to the target and rename it into place
+    # when done, so that concurrent readers never see partially written data.
+    # If the target is a symbolic link, the file it points to is replaced,
+    # not the link.
+    target = os.path.realpath(file)
+    (root, fn) = os.path.split(target)
+    (fd, tmp) = tempfile.mkstemp(dir = root, prefix = '.' + fn + '.')
+    try:
+        os.fchmod(fd, 0o666 & ~umask)
+        with os.fdopen(fd, mode) as fh:
+            yield fh
+        os.replace(tmp, target)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def dumpPlain(file, data):
+    # Like dump(), but writes data as it is.
+    import yaml
+    with atomicFile(file) as fh:
+        yaml.dump(data, fh)
 
 def dump(file, data):
     (root, fn) = os.path.split(os.path.realpath(file))
     data['definition'] = fn
     data['root'] = root
-    with open(file, 'w') as fh:
-        yaml.dump(data, fh)
+    dumpPlain(file, data)
 
 def yp(data):
+    import yaml
     print(yaml.dump(data), end = '')
 
-xppx = pprint.PrettyPrinter(indent = 4)
-
 def pp(thing):
-    xppx.pprint(thing)
+    import pprint
+    pprint.PrettyPrinter(indent = 4).pprint(thing)
 
 def selectPager(cfg):
     if (cfg.lookup('pager-from-env') and 'PAGER' in os.environ):
@@ -90,18 +178,62 @@ def pager(cfg, thunk):
         thunk()
     proc.wait()
 
-def logOutput(log, pipe):
-    for line in iter(pipe.readline, b''):
-        log.info(line.decode(errors = 'backslashreplace').rstrip())
+pumpChunkSize = 64 * 1024
 
-def loggedProcess(cfg, log, cmd, env = None):
+def batchHandler(log):
+    for handler in log.handlers:
+        if hasattr(handler, 'writeBatch'):
+            return handler
+    return None
+
+def logLines(log, handler, lines):
+    if handler is None or not handler.writeBatch(log.name, lines):
+        for line in lines:
+            log.info(line)
+
+def logOutput(log, pipe, observer = None):
+    # Read output in large chunks instead of line by line, and hand complete
+    # lines to the log handler in batches. Verbose builds produce millions of
+    # lines, and logging those one record at a time slows down the child
+    # process, when its pipe fills up. An observer, if given, is called with
+    # every batch of lines as well.
+    #
+    # An incomplete line at the end of a chunk is kept as a list of pieces,
+    # that are joined once its end arrives. Very long lines, like progress
+    # bars without newlines, would take quadratic time otherwise.
+    handler = batchHandler(log)
+    fd = pipe.fileno()
+    rest = []
+    while True:
+        chunk = os.read(fd, pumpChunkSize)
+        if (len(chunk) == 0):
+            break
+        end = chunk.rfind(b'\n')
+        if (end < 0):
+            rest.append(chunk)
+            continue
+        rest.append(chunk[:end])
+        text = b''.join(rest).decode(errors = 'backslashreplace')
+        rest = [ chunk[end+1:] ]
+        lines = [ l.rstrip() for l in text.split('\n') ]
+        logLines(log, handler, lines)
+        if (observer is not None):
+            observer(lines)
+    rest = b''.join(rest)
+    if (len(rest) > 0):
+        lines = [ rest.decode(errors = 'backslashreplace').rstrip() ]
+        logLines(log, handler, lines)
+        if (observer is not None):
+            observer(lines)
+
+def loggedProcess(cfg, log, cmd, env = None, observer = None):
     log.info("Running command: {}".format(cmd))
     if cfg.lookup('log-all'):
         proc = subprocess.Popen(
             cmd, stdout = subprocess.PIPE, stderr = subprocess.STDOUT,
             env = env)
         with proc.stdout:
-            logOutput(log, proc.stdout)
+            logOutput(log, proc.stdout, observer)
         return proc.wait()
     rc = subprocess.run(cmd)
     return rc.returncode
@@ -146,12 +278,36 @@ def flatten(lst):
     else:
         return [lst]
 
+# Mako templates are expanded for many configuration values, mostly the same
+# few ones over and over, and most of them contain no markup at all. Those are
+# returned as they are. The others are compiled once and kept in a bounded
+# cache, keyed by their text.
+
+templateCacheSize = 256
+
+def plainTemplate(tmpl):
+    # True if tmpl contains nothing mako would expand: No expressions, no
+    # comments and no line continuations. Any percent sign may start a tag or
+    # a control line.
+    return not ('${' in tmpl or '%' in tmpl
+                or '##' in tmpl or '\\\n' in tmpl)
+
+@functools.lru_cache(maxsize = templateCacheSize)
+def compileTemplate(tmpl):
+    # Importing mako takes longer than everything else mmh does on start-up,
+    # so it is only imported by the commands that expand templates.
+    import mako.template as mako
+    return mako.Template(tmpl)
+
+def renderTemplate(tmpl, **data):
+    if (plainTemplate(tmpl)):
+        return tmpl
+    return compileTemplate(tmpl).render(**data)
+
 def expandFile(tmpl):
     if tmpl is None:
         return None
-    curdir = os.getcwd()
-    exp = mako.Template(tmpl).render(system = curdir)
-    return exp
+    return renderTemplate(tmpl, system = os.getcwd())
 
 def maybeMatch(lst, pat):
     m = fnmatch.filter(lst, pat)
@@ -181,6 +337,10 @@ def findByName(lst, name):
 
 def maybeShowPhase(log, phase, tag, args):
     string = f'{tag}: {phase}'
+    handler = batchHandler(log)
+    if (handler is not None):
+        handler.markPhase(phase)
+    events.emit('phase', instance = tag, phase = phase)
     log.info(f'Phase: {string}')
     if (args.log_to_file and args.show_phases):
         print(string, flush = True)
@@ -1,6 +1,6 @@
-import copy
 import fnmatch
 import os
+import re
 
 from functools import reduce
 
@@ -45,9 +45,10 @@ class SourceStack(YamlStack):
         # The top level data structure is a dict. With sources, we only care
         # about the ‘modules’ and ‘remove’ keys. The merged dict will contain
         # ‘modules’ only, processing the ‘remove’ key as we move up the layers.
+        # Nothing in the layers is modified, so the merged data can share the
+        # parts, that do not need merging, with them.
         self.merged = { 'modules': {} }
-        slices = copy.deepcopy(reversed(self.data))
-        for slice in slices:
+        for slice in reversed(self.data):
             if ('remove' in slice and 'modules' in slice['remove']):
                 for rem in slice['remove']['modules']:
                     del(self.merged['modules'][rem])
@@ -60,11 +61,14 @@ class SourceStack(YamlStack):
                     else:
                         self.merged['modules'][mod] = slice['modules'][mod]
 
-        for module in self.merged['modules']:
-            if ('type' not in self.merged['modules'][module]):
-                self.merged['modules'][module]['type'] = 'git'
-            if ('main' not in self.merged['modules'][module]):
-                self.merged['modules'][module]['main'] = [ 'main', 'master' ]
+        modules = self.merged['modules']
+        for module in modules:
+            entry = modules[module]
+            if ('type' not in entry or 'main' not in entry):
+                entry = dict(entry)
+                entry.setdefault('type', 'git')
+                entry.setdefault('main', [ 'main', 'master' ])
+                modules[module] = entry
 
     def allSources(self):
         if (self.merged == None):
@@ -87,6 +91,81 @@ class UnknownConfigItem(Exception):
 class UnknownToolchain(Exception):
     pass
 
+def overrideResult(rover):
+    # Returns what a matching revision override decides, as a tuple of True
+    # and the decision. Overrides, that do not decide anything, make the
+    # lookup move on to the next one. For those, this returns (False, None).
+    if ('preserve' in rover):
+        if (rover['preserve']):
+            return (True, None)
+        return (False, None)
+    elif ('revision' in rover):
+        return (True, rover['revision'])
+    elif ('use-latest-revision' in rover):
+        if (not rover['use-latest-revision']):
+            return (True, None)
+        pattern = '*'
+        if ('use-latest-revision-pattern' in rover):
+            pattern = rover['use-latest-revision-pattern']
+        return (True, ('!latest', pattern))
+    elif ('use-main-branch' in rover):
+        if (not rover['use-main-branch']):
+            return (True, None)
+        return (True, '!main')
+    return (False, None)
+
+class OverrideMatcher:
+    # Revision overrides are looked up for every dependency, often more than
+    # once, in a list that may be long. So the list is compiled once: Names
+    # without wildcards go into a dict, patterns into a single regular
+    # expression, with one alternative per override, in the order of the
+    # list. Overrides, that do not decide anything, are left out. The first
+    # override matching a module decides, and that result is remembered.
+    def __init__(self, lst):
+        self.rules = lst
+        self.results = {}
+        self.exact = {}
+        self.cache = {}
+        patterns = []
+        for (n, rover) in enumerate(lst):
+            if ('name' not in rover):
+                continue
+            (decides, result) = overrideResult(rover)
+            if (not decides):
+                continue
+            self.results[n] = result
+            name = rover['name']
+            if (mmh.isPattern(name)):
+                patterns.append('(?P<r{}>{})'.format(n, fnmatch.translate(name)))
+            elif (name not in self.exact):
+                self.exact[name] = n
+        self.regex = None
+        if (len(patterns) > 0):
+            self.regex = re.compile('|'.join(patterns))
+
+    def match(self, mod):
+        # Returns the index of the override, that decides for a module, or
+        # None if there is none.
+        if (mod in self.cache):
+            return self.cache[mod]
+        rv = self.exact.get(mod)
+        if (self.regex is not None):
+            m = self.regex.match(mod)
+            if (m is not None):
+                n = int(m.lastgroup[1:])
+                if (rv is None or n < rv):
+                    rv = n
+        self.cache[mod] = rv
+        return rv
+
+    def rule(self, mod):
+        n = self.match(mod)
+        return None if n is None else self.rules[n]
+
+    def result(self, mod):
+        n = self.match(mod)
+        return None if n is None else self.results[n]
+
 class ConfigStack(YamlStack):
     def __init__(self, log, desc, *lst):
         YamlStack.__init__(self, log, desc, *lst)
@@ -95,10 +174,33 @@ class ConfigStack(YamlStack):
         self.mergeLists = [ 'buildtools', 'buildconfigs' ]
         self.mergeDicts = [ 'dependency-summary' ]
         self.mergeLODbyName = [ 'revision-overrides', 'toolchains' ]
+        # The state of the merge: The layers merged so far, the merged data
+        # and, for the lists merged by name, dicts mapping names to entries.
+        self.layers = None
+        self.state = None
+        self.index = None
+        self.overrides = None
+
+    def isMerged(self):
+        return (self.layers is not None
+                and len(self.layers) == len(self.data)
+                and all(a is b for (a, b) in zip(self.layers, self.data)))
+
+    def pushLayer(self, layer):
+        # If the stack was merged already, the new layer is merged on top of
+        # that, instead of merging all layers again.
+        merged = self.isMerged()
+        YamlStack.pushLayer(self, layer)
+        if merged:
+            self.layers.insert(0, layer)
+            self.mergeLayer(layer)
+            self.finishMerge()
 
     def merge(self):
         if (self.data == None):
             raise(NoConfigData())
+        if self.isMerged():
+            return
 
         # The top level data structure is a dict. These are predefined types as
         # lists, so we're populating them here. Toolchains and overrides are
@@ -106,50 +208,76 @@ class ConfigStack(YamlStack):
         # and configs are merged on string values. These lists also support
         # removal by the top-level ‘remove’ key, using the same matching. With
         # other top-level keys, the one from the highest priority layer wins.
-        self.merged = { 'buildtools':         [],
-                        'buildconfigs':       [],
-                        'toolchains':         [],
-                        'revision-overrides': [] }
-        slices = list(copy.deepcopy(reversed(self.data)))
-        for slice in slices:
-            if ('remove' in slice):
-                for cat in slice['remove']:
-                    if (slice['remove'][cat] == True):
-                        self.merged[cat] = []
-                    elif (cat in self.mergeLists):
-                        self.merged[cat] = list(
-                            filter(lambda x: (x not in slice['remove'][cat]),
-                                   self.merged[cat]))
-                    elif (cat in self.mergeLODbyName):
-                        self.merged[cat] = list(
-                            filter(lambda x: (x['name'] not in slice['remove'][cat]),
-                                   self.merged[cat]))
-
-            for key in slice:
-                if (key in self.mergeLists):
-                    self.merged[key] = list(set(slice[key] + self.merged[key]))
-                elif (key in self.mergeLODbyName):
-                    # We're reversing here for correct order in revision-
-                    # overrides, since those names can be patterns. With the
-                    # other keys of this type, order does not matter.
-                    for entry in reversed(slice[key]):
-                        idx = mmh.findByName(self.merged[key], entry['name'])
-                        if (idx != None):
-                            new = { **self.merged[key][idx], **entry }
-                            del(self.merged[key][idx])
-                        else:
-                            new = entry
-                        self.merged[key].insert(0, new)
-                elif (key in self.mergeDicts):
-                    if (key not in self.merged):
-                        self.merged[key] = {}
-                    self.merged[key] = { **self.merged[key], **slice[key] }
-                else:
-                    self.merged[key] = slice[key]
-
-        for rem in self.remove:
-            if (rem in self.merged):
-                del(self.merged[rem])
+        # Nothing in the layers is modified, so the merged data can share the
+        # parts, that do not need merging, with them.
+        self.state = { 'buildtools':         [],
+                       'buildconfigs':       [],
+                       'toolchains':         None,
+                       'revision-overrides': None }
+        self.index = { key: {} for key in self.mergeLODbyName }
+        for slice in reversed(self.data):
+            self.mergeLayer(slice)
+        self.layers = list(self.data)
+        self.finishMerge()
+
+    def mergeLayer(self, slice):
+        state = self.state
+        if ('remove' in slice):
+            for cat in slice['remove']:
+                rem = slice['remove'][cat]
+                if (rem == True):
+                    if (cat in self.mergeLODbyName):
+                        self.index[cat] = {}
+                    else:
+                        state[cat] = []
+                elif (cat in self.mergeLists):
+                    state[cat] = [ x for x in state[cat] if x not in rem ]
+                elif (cat in self.mergeLODbyName):
+                    self.index[cat] = { name: entry for (name, entry)
+                                        in self.index[cat].items()
+                                        if name not in rem }
+
+        for key in slice:
+            if (key in self.mergeLists):
+                state[key] = list(set(slice[key] + state[key]))
+            elif (key in self.mergeLODbyName):
+                self.mergeByName(key, slice[key])
+            elif (key in self.mergeDicts):
+                if (key not in state):
+                    state[key] = {}
+                state[key] = { **state[key], **slice[key] }
+            else:
+                state[key] = slice[key]
+
+    def mergeByName(self, key, entries):
+        # The entries of a layer go in front of the ones merged before, in the
+        # order of the layer. That order is important with revision-overrides,
+        # since their names can be patterns. With the other keys of this type,
+        # order does not matter. Entries of the same name are merged, those of
+        # the layer, and earlier ones within it, taking precedence.
+        old = self.index[key]
+        front = {}
+        for entry in reversed(entries):
+            name = entry['name']
+            if (name in front):
+                base = front.pop(name)
+            else:
+                base = old.pop(name, None)
+            front[name] = entry if base is None else { **base, **entry }
+        new = dict(reversed(front.items()))
+        new.update(old)
+        self.index[key] = new
+
+    def finishMerge(self):
+        self.overrides = None
+        self.merged = {}
+        for key in self.state:
+            if (key in self.remove):
+                continue
+            if (key in self.mergeLODbyName):
+                self.merged[key] = list(self.index[key].values())
+            else:
+                self.merged[key] = self.state[key]
 
     def lookup(self, needle):
         if (self.data == None):
@@ -190,28 +318,14 @@ class ConfigStack(YamlStack):
     def allOverrides(self):
         return self.lookup('revision-overrides')
 
+    def overrideMatcher(self):
+        if (self.overrides is None):
+            self.overrides = OverrideMatcher(self.allOverrides())
+        return self.overrides
+
     def processOverrides(self, mod):
-        lst = self.allOverrides()
-        for rover in lst:
-            if ('name' not in rover):
-                continue
-            pattern = rover['name']
-            if (fnmatch.fnmatch(mod, pattern)):
-                if ('preserve' in rover):
-                    if (rover['preserve']):
-                        return None
-                    continue
-                elif ('revision' in rover):
-                    return rover['revision']
-                elif ('use-latest-revision' in rover):
-                    if (not rover['use-latest-revision']):
-                        return None
-                    pattern = '*'
-                    if ('use-latest-revision-pattern' in rover):
-                        pattern = rover['use-latest-revision-pattern']
-                    return ('!latest', pattern)
-                elif ('use-main-branch' in rover):
-                    if (not rover['use-main-branch']):
-                        return None
-                    return '!main'
-        return None
+        return self.overrideMatcher().result(mod)
+
+    def matchingOverride(self, mod):
+        # Returns the revision override, that decides for a module, or None.
+        return self.overrideMatcher().rule(mod)
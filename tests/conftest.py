@@ -0,0 +1,45 @@
+import os
+import subprocess
+
+import logbook
+import pytest
+
+# Shared fixtures for the test suite. Tests run against local git
+# repositories and temporary directories only; nothing touches the network
+# or the user's configuration.
+
+@pytest.fixture(autouse = True)
+def isolate(tmp_path, monkeypatch):
+    # Keep caches and configuration, that mmh may write, out of $HOME.
+    monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path / 'config'))
+    for var in [ 'GIT_AUTHOR', 'GIT_COMMITTER' ]:
+        monkeypatch.setenv(var + '_NAME', 'mmh')
+        monkeypatch.setenv(var + '_EMAIL', 'mmh@example.com')
+
+@pytest.fixture
+def log():
+    return logbook.Logger('mmh-test')
+
+def git(d, *args):
+    subprocess.run([ 'git', '-C', str(d) ] + list(args), check = True,
+                   stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+
+def commit(d, fn, content):
+    with open(os.path.join(d, fn), 'w') as fh:
+        fh.write(content)
+    git(d, 'add', fn)
+    git(d, 'commit', '--quiet', '-m', 'Update ' + fn)
+
+@pytest.fixture
+def makeRepository(tmp_path):
+    # Returns a function, that creates a repository with a single commit on
+    # its main branch, and returns its file:// URL.
+    def make(name):
+        d = tmp_path / 'upstream' / name
+        d.mkdir(parents = True)
+        git(d, 'init', '--quiet', '--initial-branch=main')
+        commit(d, 'README', name + '\n')
+        return 'file://' + str(d)
+    return make
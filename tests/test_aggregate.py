@@ -0,0 +1,80 @@
+import json
+import os
+
+import makemehappy.result as result
+
+prefix = '[2026-01-02 03:04:05.678901] INFO: MakeMeHappy: '
+
+def writeLog(fn, builds = 2):
+    os.makedirs(os.path.dirname(fn), exist_ok = True)
+    with open(fn, 'w') as fh:
+        fh.write(prefix + 'Build Summary:\n')
+        fh.write(prefix + 'All {} builds succeeded.\n'.format(builds))
+
+def statuses(lst):
+    return [ (os.path.basename(fname), summary['status'])
+             for (fname, st, summary) in lst ]
+
+def testDanglingLink(tmp_path):
+    writeLog(str(tmp_path / 'logs' / 'a.log'))
+    (tmp_path / 'logs' / 'b.log').symlink_to('nowhere')
+    lst = result.aggregateLogs(result.findLogs([ str(tmp_path / 'logs') ]))
+    assert statuses(lst) == [ ('a.log', 'success'), ('b.log', 'unreadable') ]
+    assert lst[1][1] is None
+
+def testForeignFiles(tmp_path):
+    writeLog(str(tmp_path / 'logs' / 'a.log'))
+    (tmp_path / 'logs' / 'notes.jsonl').write_text('{"foo": 1}\n')
+    lst = result.aggregateLogs(result.findLogs([ str(tmp_path / 'logs') ]))
+    assert statuses(lst) == [ ('a.log', 'success'),
+                              ('notes.jsonl', 'unreadable') ]
+
+def cacheFiles(cachedir):
+    rv = {}
+    for fn in os.listdir(cachedir):
+        with open(os.path.join(cachedir, fn)) as fh:
+            data = json.load(fh)
+        rv[data['directory']] = sorted(data['logs'])
+    return rv
+
+def testCacheIsReused(tmp_path, monkeypatch):
+    cachedir = str(tmp_path / 'cache')
+    logs = str(tmp_path / 'logs')
+    writeLog(os.path.join(logs, 'a.log'))
+    files = result.findLogs([ logs ])
+    first = result.aggregateLogs(files, cachedir = cachedir)
+    def fail(fname):
+        raise(AssertionError('read instead of using the cache'))
+    monkeypatch.setattr(result, 'summariseLog', fail)
+    assert result.aggregateLogs(files, cachedir = cachedir) == first
+
+def testCacheIsShardedAndPruned(tmp_path):
+    cachedir = str(tmp_path / 'cache')
+    one = str(tmp_path / 'one')
+    two = str(tmp_path / 'two')
+    for fn in [ 'a.log', 'b.log' ]:
+        writeLog(os.path.join(one, fn))
+        writeLog(os.path.join(two, fn))
+    result.aggregateLogs(result.findLogs([ one, two ]), cachedir = cachedir)
+    assert cacheFiles(cachedir) == { one: [ 'a.log', 'b.log' ],
+                                     two: [ 'a.log', 'b.log' ] }
+
+    # Looking at one directory does not rewrite the other's cache.
+    before = os.stat(result.aggregateCacheFile(cachedir, two)).st_mtime_ns
+    os.unlink(os.path.join(one, 'b.log'))
+    writeLog(os.path.join(one, 'c.log'))
+    result.aggregateLogs(result.findLogs([ one ]), cachedir = cachedir)
+    assert cacheFiles(cachedir) == { one: [ 'a.log', 'c.log' ],
+                                     two: [ 'a.log', 'b.log' ] }
+    assert (os.stat(result.aggregateCacheFile(cachedir, two)).st_mtime_ns
+            == before)
+
+def testChangedLogsAreRead(tmp_path):
+    cachedir = str(tmp_path / 'cache')
+    fn = str(tmp_path / 'logs' / 'a.log')
+    writeLog(fn)
+    result.aggregateLogs([ fn ], cachedir = cachedir)
+    writeLog(fn, builds = 12)
+    [ (fname, st, summary) ] = result.aggregateLogs([ fn ],
+                                                    cachedir = cachedir)
+    assert summary['builds'] == 12
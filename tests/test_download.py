@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+
+import makemehappy.download as download
+import makemehappy.utilities as mmh
+import makemehappy.yamlstack as ys
+
+from conftest import commit
+
+def sourceStack(log, tmp_path, repositories):
+    fn = tmp_path / 'sources.yaml'
+    mmh.dump(str(fn), { 'modules': {
+        name: { 'repository': url } for (name, url) in repositories.items() } })
+    src = ys.SourceStack(log, 'source definition', str(fn))
+    src.load()
+    src.merge()
+    return src
+
+def arguments(destination, jobs = 4, bare = False, resume = False):
+    return argparse.Namespace(destination = str(destination), jobs = jobs,
+                              clone_bare = bare, resume = resume,
+                              log_to_file = False, show_phases = False)
+
+def head(d):
+    (stdout, stderr, rc) = mmh.stdoutProcess(
+        [ 'git', '-C', str(d), 'rev-parse', 'HEAD' ])
+    return stdout
+
+def testCloneInParallel(log, tmp_path, makeRepository):
+    repositories = { name: makeRepository(name)
+                     for name in [ 'alpha', 'beta', 'gamma', 'delta' ] }
+    src = sourceStack(log, tmp_path, repositories)
+    dest = tmp_path / 'mirror'
+    assert download.downloadSources(None, log, src, arguments(dest))
+    for name in repositories:
+        assert os.path.isfile(dest / name / 'README')
+    # Everything succeeded, so there is nothing to resume.
+    assert not os.path.exists(dest / download.stateFile)
+    # Nothing but the clones, and the directory holding their locks.
+    assert (sorted(os.listdir(dest))
+            == sorted([ '.mmh-locks' ] + list(repositories)))
+
+def testFetchIntoExistingClones(log, tmp_path, makeRepository):
+    url = makeRepository('alpha')
+    src = sourceStack(log, tmp_path, { 'alpha': url })
+    dest = tmp_path / 'mirror'
+    assert download.downloadSources(None, log, src, arguments(dest))
+    marker = dest / 'alpha' / 'untracked'
+    marker.write_text('kept\n')
+
+    upstream = url[len('file://'):]
+    commit(upstream, 'NEWS', 'news\n')
+    assert download.downloadSources(None, log, src, arguments(dest))
+    # A fetch and fast-forward, not a new clone.
+    assert marker.exists()
+    assert head(dest / 'alpha') == head(upstream)
+
+def testReplaceInterruptedClone(log, tmp_path, makeRepository):
+    src = sourceStack(log, tmp_path, { 'alpha': makeRepository('alpha') })
+    dest = tmp_path / 'mirror'
+    partial = dest / ('alpha' + download.partialSuffix)
+    partial.mkdir(parents = True)
+    (partial / 'leftover').write_text('')
+    assert download.downloadSources(None, log, src, arguments(dest))
+    assert os.path.isfile(dest / 'alpha' / 'README')
+    assert not os.path.exists(dest / 'alpha' / 'leftover')
+    assert not os.path.exists(partial)
+
+def testKeepUnknownDirectories(log, tmp_path, makeRepository):
+    src = sourceStack(log, tmp_path, { 'alpha': makeRepository('alpha') })
+    dest = tmp_path / 'mirror'
+    (dest / 'alpha').mkdir(parents = True)
+    (dest / 'alpha' / 'mywork.txt').write_text('precious\n')
+    assert not download.downloadSources(None, log, src, arguments(dest))
+    assert (dest / 'alpha' / 'mywork.txt').read_text() == 'precious\n'
+
+def testKeepRepositoriesOfOtherKind(log, tmp_path, makeRepository):
+    src = sourceStack(log, tmp_path, { 'alpha': makeRepository('alpha') })
+    dest = tmp_path / 'mirror'
+    assert download.downloadSources(None, log, src, arguments(dest))
+    (dest / 'alpha' / 'mywork.txt').write_text('precious\n')
+    assert not download.downloadSources(None, log, src,
+                                        arguments(dest, bare = True))
+    assert (dest / 'alpha' / 'mywork.txt').read_text() == 'precious\n'
+    assert os.path.isfile(dest / 'alpha' / 'README')
+
+def interruptedRun(dest, bare = False):
+    # The state of a run, that was interrupted after alpha was done.
+    dest.mkdir()
+    state = download.newState(str(dest), bare)
+    state['done']['alpha'] = 'main'
+    download.saveState(str(dest / download.stateFile), state)
+
+def testResumeInterruptedRun(log, tmp_path, makeRepository):
+    src = sourceStack(log, tmp_path, { 'alpha': makeRepository('alpha'),
+                                       'beta': makeRepository('beta') })
+    dest = tmp_path / 'mirror'
+    interruptedRun(dest)
+    assert download.downloadSources(None, log, src,
+                                    arguments(dest, resume = True))
+    assert not os.path.exists(dest / 'alpha')
+    assert os.path.isfile(dest / 'beta' / 'README')
+    assert not os.path.exists(dest / download.stateFile)
+
+def testResumeOnlyOnRequest(log, tmp_path, makeRepository):
+    src = sourceStack(log, tmp_path, { 'alpha': makeRepository('alpha'),
+                                       'beta': makeRepository('beta') })
+    dest = tmp_path / 'mirror'
+    interruptedRun(dest)
+    assert download.downloadSources(None, log, src, arguments(dest))
+    assert os.path.isfile(dest / 'alpha' / 'README')
+
+def testResumeOnlyMatchingRun(log, tmp_path, makeRepository):
+    src = sourceStack(log, tmp_path, { 'alpha': makeRepository('alpha') })
+    dest = tmp_path / 'mirror'
+    interruptedRun(dest, bare = True)
+    assert download.downloadSources(None, log, src,
+                                    arguments(dest, resume = True))
+    assert os.path.isfile(dest / 'alpha' / 'README')
+
+def testBareMirrors(log, tmp_path, makeRepository):
+    url = makeRepository('alpha')
+    src = sourceStack(log, tmp_path, { 'alpha': url })
+    dest = tmp_path / 'mirror'
+    args = arguments(dest, bare = True)
+    assert download.downloadSources(None, log, src, args)
+    upstream = url[len('file://'):]
+    commit(upstream, 'NEWS', 'news\n')
+    assert download.downloadSources(None, log, src, args)
+    assert head(dest / 'alpha') == head(upstream)
+
+def testFailureKeepsState(log, tmp_path, makeRepository):
+    src = sourceStack(log, tmp_path,
+                      { 'alpha': makeRepository('alpha'),
+                        'missing': 'file://' + str(tmp_path / 'nowhere') })
+    dest = tmp_path / 'mirror'
+    assert not download.downloadSources(None, log, src, arguments(dest))
+    with open(dest / download.stateFile) as fh:
+        state = json.load(fh)
+    assert sorted(state) == [ 'bare', 'destination', 'done', 'run' ]
+    assert list(state['done']) == [ 'alpha' ]
+    # Without --resume, the next run refreshes everything.
+    assert not download.downloadSources(None, log, src, arguments(dest))
+    with open(dest / download.stateFile) as fh:
+        assert json.load(fh)['run'] != state['run']
@@ -0,0 +1,42 @@
+import os
+import shutil
+
+import makemehappy.instancelog as il
+
+def addInstance(root, name, size = 10):
+    fn = os.path.join(il.logRoot(root), il.logName(name))
+    il.updateIndex(root, name, fn, { 'size': size, 'phases': { 'build': 0 } })
+    return fn
+
+def testIndexHoldsInstancesOnly(tmp_path):
+    root = str(tmp_path / 'build')
+    os.makedirs(il.logRoot(root))
+    addInstance(root, 'alpha')
+    addInstance(root, 'beta')
+    data = il.loadIndex(il.indexName(root))
+    assert list(data) == [ 'instances' ]
+    assert sorted(data['instances']) == [ 'alpha', 'beta' ]
+    with open(il.indexName(root)) as fh:
+        assert str(tmp_path) not in fh.read()
+
+def testIndexSurvivesMovingTheRoot(tmp_path):
+    root = str(tmp_path / 'build')
+    os.makedirs(il.logRoot(root))
+    addInstance(root, 'alpha')
+    moved = str(tmp_path / 'moved')
+    shutil.move(root, moved)
+    lst = il.select(il.findIndex(moved), [ '*' ])
+    assert [ (name, fn) for (name, fn, entry) in lst ] == [
+        ('alpha', os.path.join(il.logRoot(moved), 'alpha.log')) ]
+
+def testOldIndex(tmp_path):
+    # Earlier versions stored the build root along with the instances.
+    root = str(tmp_path / 'build')
+    os.makedirs(il.logRoot(root))
+    with open(il.indexName(root), 'w') as fh:
+        fh.write('definition: index.yaml\nroot: /elsewhere\n'
+                 + 'instances:\n  alpha: { log: alpha.log, size: 1 }\n')
+    addInstance(root, 'beta')
+    data = il.loadIndex(il.indexName(root))
+    assert list(data) == [ 'instances' ]
+    assert sorted(data['instances']) == [ 'alpha', 'beta' ]
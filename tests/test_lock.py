@@ -0,0 +1,119 @@
+import fcntl
+import os
+import threading
+
+import pytest
+
+import makemehappy.utilities as mmh
+
+from makemehappy.lock import FileLock, lockName
+
+def acquireInThread(path, shared = False):
+    # Returns an event, that is set once the lock was acquired in another
+    # thread, and a function, that releases it again.
+    acquired = threading.Event()
+    done = threading.Event()
+    def run():
+        with FileLock(path, shared = shared):
+            acquired.set()
+            done.wait()
+    thread = threading.Thread(target = run)
+    thread.start()
+    def release():
+        done.set()
+        thread.join()
+    return (acquired, release)
+
+def testLockFileIsHidden(tmp_path):
+    d = tmp_path / 'module'
+    d.mkdir()
+    with FileLock(str(d)):
+        assert os.listdir(d) == []
+        assert os.path.exists(lockName(str(d)))
+    assert lockName(str(d)) == str(tmp_path / '.mmh-locks' / 'module.lock')
+
+def testLocksShareDirectory(tmp_path):
+    for name in [ 'alpha', 'beta', 'gamma' ]:
+        (tmp_path / name).mkdir()
+        with FileLock(str(tmp_path / name)):
+            pass
+    assert sorted(os.listdir(tmp_path)) == [ '.mmh-locks', 'alpha',
+                                             'beta', 'gamma' ]
+
+def testInterruptedAcquireClosesFile(tmp_path, monkeypatch):
+    def interrupt(fd, mode):
+        raise(KeyboardInterrupt())
+    opened = []
+    def recordOpen(*args):
+        opened.append(realOpen(*args))
+        return opened[-1]
+    realOpen = os.open
+    monkeypatch.setattr(fcntl, 'flock', interrupt)
+    monkeypatch.setattr(os, 'open', recordOpen)
+    lock = FileLock(str(tmp_path / 'state.yaml'))
+    with pytest.raises(KeyboardInterrupt):
+        lock.acquire()
+    monkeypatch.undo()
+    assert lock.fd is None
+    assert len(opened) == 1
+    with pytest.raises(OSError):
+        os.fstat(opened[0])
+
+def testExclusiveLocksExclude(tmp_path):
+    path = str(tmp_path / 'state.yaml')
+    lock = FileLock(path)
+    lock.acquire()
+    (acquired, release) = acquireInThread(path)
+    assert not acquired.wait(0.2)
+    lock.release()
+    assert acquired.wait(5)
+    release()
+
+def testSharedLocksShare(tmp_path):
+    path = str(tmp_path / 'state.yaml')
+    with FileLock(path, shared = True):
+        (acquired, release) = acquireInThread(path, shared = True)
+        assert acquired.wait(5)
+        release()
+        (acquired, release) = acquireInThread(path)
+        assert not acquired.wait(0.2)
+    assert acquired.wait(5)
+    release()
+
+def testAtomicFileReplaces(tmp_path):
+    fn = tmp_path / 'state.yaml'
+    fn.write_text('old\n')
+    with mmh.atomicFile(str(fn)) as fh:
+        fh.write('new\n')
+        # Nothing is visible before the file is complete.
+        assert fn.read_text() == 'old\n'
+    assert fn.read_text() == 'new\n'
+    assert os.listdir(tmp_path) == [ 'state.yaml' ]
+
+def testAtomicFileKeepsOldDataOnError(tmp_path):
+    fn = tmp_path / 'state.yaml'
+    fn.write_text('old\n')
+    try:
+        with mmh.atomicFile(str(fn)) as fh:
+            fh.write('partial')
+            raise(RuntimeError('interrupted'))
+    except RuntimeError:
+        pass
+    assert fn.read_text() == 'old\n'
+    assert os.listdir(tmp_path) == [ 'state.yaml' ]
+
+def testAtomicFileFollowsSymlinks(tmp_path):
+    real = tmp_path / 'real.yaml'
+    real.write_text('old\n')
+    link = tmp_path / 'link.yaml'
+    link.symlink_to(real)
+    with mmh.atomicFile(str(link)) as fh:
+        fh.write('new\n')
+    assert link.is_symlink()
+    assert real.read_text() == 'new\n'
+
+def testAtomicFilePermissions(tmp_path):
+    fn = tmp_path / 'state.yaml'
+    with mmh.atomicFile(str(fn)) as fh:
+        fh.write('data\n')
+    assert (os.stat(fn).st_mode & 0o777) == (0o666 & ~mmh.umask)
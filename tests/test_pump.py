@@ -0,0 +1,86 @@
+import sys
+
+import logbook
+import pytest
+
+import makemehappy.result as result
+import makemehappy.utilities as mmh
+
+from makemehappy.loghandler import MMHLogHandler
+
+# The output pump reads child output in chunks and writes complete lines in
+# batches. Whatever the chunk boundaries, the log has to contain the same
+# lines, in the format result.py expects.
+
+class Config:
+    def lookup(self, key):
+        return (key == 'log-all')
+
+def childOutput(fn):
+    # A command, that writes the contents of a file to stdout, in one go.
+    return [ sys.executable, '-c',
+             'import sys; '
+             + 'sys.stdout.buffer.write(open(sys.argv[1], "rb").read())',
+             str(fn) ]
+
+def expectedLines(data):
+    text = data.decode(errors = 'backslashreplace')
+    if (len(text) == 0):
+        return []
+    lines = [ line.rstrip() for line in text.split('\n') ]
+    if (text.endswith('\n')):
+        lines.pop()
+    return lines
+
+def pumpToFile(tmp_path, data):
+    output = tmp_path / 'output'
+    output.write_bytes(data)
+    fn = tmp_path / 'mmh.log'
+    log = logbook.Logger('MakeMeHappy')
+    handler = MMHLogHandler()
+    handler.setFile(str(fn))
+    log.handlers.append(handler)
+    seen = []
+    rc = mmh.loggedProcess(Config(), log, childOutput(output),
+                           observer = seen.extend)
+    handler.close()
+    assert rc == 0
+    with open(fn) as fh:
+        lines = [ line.rstrip('\n') for line in fh ]
+    # The first line is the "Running command:" record.
+    assert lines[0].endswith('Running command: {}'.format(childOutput(output)))
+    for line in lines:
+        assert result.strip.match(line)
+    return ([ result.strip.sub('', line, count = 1) for line in lines[1:] ],
+            seen)
+
+samples = [
+    b'',
+    b'one line\n',
+    b'no newline at the end',
+    b'a\nbb\n\nccc\n',
+    b'trailing blanks   \nand tabs\t\n',
+    b'invalid utf-8: \xff\xfe\n',
+    b''.join(b'[%d/1000] Building C object foo%d.o\n' % (n, n)
+             for n in range(1000)),
+    b'x' * 100000 + b'\n' + b'y' * 100000 ]
+
+@pytest.mark.parametrize('chunk', [ 1, 7, 4096, 65536 ])
+@pytest.mark.parametrize('data', samples, ids = range(len(samples)))
+def testPumpKeepsLines(tmp_path, monkeypatch, chunk, data):
+    monkeypatch.setattr(mmh, 'pumpChunkSize', chunk)
+    (lines, seen) = pumpToFile(tmp_path, data)
+    assert lines == expectedLines(data)
+    assert seen == expectedLines(data)
+
+def testPumpWithoutFile(tmp_path):
+    # Before the log file is set up, lines become individual records.
+    output = tmp_path / 'output'
+    output.write_bytes(b'a\nb\nc')
+    log = logbook.Logger('MakeMeHappy')
+    with logbook.TestHandler() as handler:
+        rc = mmh.loggedProcess(Config(), log, childOutput(output))
+    assert rc == 0
+    assert handler.formatted_records[1:] == [ '[INFO] MakeMeHappy: a',
+                                              '[INFO] MakeMeHappy: b',
+                                              '[INFO] MakeMeHappy: c' ]
@@ -0,0 +1,150 @@
+import argparse
+import gzip
+import os
+import random
+
+import pytest
+
+import makemehappy.result as result
+
+# The incident scanner takes a number of short cuts: Lines are prefiltered by
+# substrings, plain logs are searched in memory mapped windows, large logs
+# are split into chunks, that are scanned in parallel, and growing logs are
+# scanned incrementally. All of these have to find exactly what scanning
+# every line of the log, one after another, finds.
+
+prefix = '[2026-01-02 03:04:05.678901] INFO: MakeMeHappy: '
+
+instances = [ 'cmake/native/m/gnu/debug/make',
+              'cmake/native/m/clang/release/ninja',
+              'cmake/native/m/ti-c2000/debug/make',
+              'boards/nucleo/gnu/debug' ]
+
+def incidentLine(rng, toolchain):
+    fn = 'src/file{}.c'.format(rng.randrange(20))
+    line = rng.randrange(1, 500)
+    kind = rng.choice([ 'warning', 'error', 'note' ])
+    if toolchain.startswith('ti-'):
+        return '"{}", line {}: {}: something is off'.format(fn, line, kind)
+    category = rng.choice([ '', ' [-Wunused-variable]', ' [-Wshadow]' ])
+    return '{}:{}:{}: {}: something {} is off{}'.format(
+        fn, line, rng.randrange(1, 80), kind, rng.randrange(5), category)
+
+def noiseLine(rng):
+    return rng.choice([ '-- Looking for include file foo.h - found',
+                        '[{}/100] Building C object foo.o'.format(
+                            rng.randrange(100)),
+                        'note: this looks like: a warning, but is not',
+                        'Running command: [\'ninja\']',
+                        '' ])
+
+def generateLog(seed, phases = 40):
+    rng = random.Random(seed)
+    lines = []
+    for n in range(phases):
+        instance = rng.choice(instances)
+        toolchain = result.instanceToolchain(instance)
+        phase = rng.choice([ 'configure', 'compile', 'compile', 'test' ])
+        lines.append(prefix + 'Phase: {}: {}'.format(instance, phase))
+        for i in range(rng.randrange(20, 80)):
+            if rng.random() < 0.2:
+                text = incidentLine(rng, toolchain)
+            else:
+                text = noiseLine(rng)
+            # Some tools bypass the logger.
+            lines.append(text if rng.random() < 0.05 else prefix + text)
+    lines.append(prefix + 'Build Summary:')
+    lines.append(prefix + 'All 3 builds succeeded.')
+    # Nothing after the result table is of interest.
+    lines.append(prefix + 'src/late.c:1:1: warning: after the table')
+    return ''.join(line + '\n' for line in lines)
+
+def writeLog(tmp_path, seed, name = 'mmh.log'):
+    fn = tmp_path / name
+    fn.write_text(generateLog(seed))
+    return str(fn)
+
+def referenceScan(fname):
+    # Every line, one after another, through all active scanners.
+    state = result.ScannerState(result.resultScanners)
+    table = result.IncidentTable()
+    with open(fname, errors = 'replace') as fh:
+        for line in fh:
+            if state.name == 'epilogue':
+                break
+            incident = result.scanLine(state,
+                                       result.strip.sub('', line, count = 1))
+            if incident is not None:
+                table.add(incident, state.instance)
+    return table
+
+def summary(table):
+    return [ table.describe(incident) for incident in table ]
+
+seeds = [ 1, 2, 3, 4, 5 ]
+
+@pytest.mark.parametrize('seed', seeds)
+def testMappedScanMatchesReference(tmp_path, monkeypatch, seed):
+    fn = writeLog(tmp_path, seed)
+    expected = summary(referenceScan(fn))
+    assert len(expected) > 0
+    assert summary(result.scan(result.resultScanners, fn)) == expected
+    # Many small windows instead of a single one.
+    monkeypatch.setattr(result, 'windowSize', 1000)
+    assert summary(result.scan(result.resultScanners, fn)) == expected
+
+@pytest.mark.parametrize('seed', seeds)
+def testCompressedScanMatchesPlain(tmp_path, seed):
+    fn = writeLog(tmp_path, seed)
+    gz = str(tmp_path / 'mmh.log.gz')
+    with open(fn, 'rb') as src, gzip.open(gz, 'wb') as dst:
+        dst.write(src.read())
+    assert (summary(result.scanFiles([ gz ]))
+            == summary(result.scanFiles([ fn ])))
+
+@pytest.mark.parametrize('seed', seeds)
+def testParallelScanMatchesSequential(tmp_path, monkeypatch, seed):
+    fn = writeLog(tmp_path, seed)
+    other = writeLog(tmp_path, seed + 100, 'other.log')
+    sequential = summary(result.scanFiles([ fn, other ], jobs = 1))
+    # Small chunks, so every log is split into many of them, and enough
+    # processors to scan them in parallel, whatever the machine has.
+    monkeypatch.setattr(result, 'minimumChunk', 2048)
+    monkeypatch.setattr(os, 'cpu_count', lambda: 4)
+    assert len(result.splitLog(fn, 16)) > 4
+    assert summary(result.scanFiles([ fn, other ], jobs = 4)) == sequential
+
+@pytest.mark.parametrize('seed', seeds)
+def testParallelMatchingLines(tmp_path, monkeypatch, seed):
+    fn = writeLog(tmp_path, seed)
+    sequential = result.scanFiles([ fn ], accumulate = False)
+    monkeypatch.setattr(result, 'minimumChunk', 2048)
+    monkeypatch.setattr(os, 'cpu_count', lambda: 4)
+    assert result.scanFiles([ fn ], accumulate = False, jobs = 4) == sequential
+
+def arguments():
+    return argparse.Namespace(json_incidents = True)
+
+@pytest.mark.parametrize('seed', seeds)
+def testIncrementalScanMatchesFull(tmp_path, capsys, seed):
+    text = generateLog(seed).encode()
+    full = summary(referenceScan(writeLog(tmp_path, seed, 'full.log')))
+    fn = str(tmp_path / 'growing.log')
+    rng = random.Random(seed)
+    # Cut the log at arbitrary points, including the middle of lines. Every
+    # other poll starts from the checkpoint file, like a new run of mmh.
+    cuts = sorted(rng.sample(range(1, len(text)), 30)) + [ len(text) ]
+    follower = result.Follower(None, arguments(), fn)
+    done = 0
+    with open(fn, 'wb') as fh:
+        for (n, cut) in enumerate(cuts):
+            fh.write(text[done:cut])
+            fh.flush()
+            done = cut
+            if n % 2 == 1:
+                follower = result.Follower(None, arguments(), fn)
+            follower.poll()
+    assert summary(follower.table) == full
+    # Every incident is shown once, as it turns up.
+    shown = capsys.readouterr().out.splitlines()
+    assert len(shown) == len(full)
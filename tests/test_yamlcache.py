@@ -0,0 +1,95 @@
+import os
+
+import yaml
+
+import makemehappy.utilities as mmh
+
+# utilities.load() keeps parsed YAML files in a cache below
+# $XDG_CACHE_HOME. Whatever the cache holds, load() has to return what
+# parsing the file returns now.
+
+document = '''
+modules:
+  ufw:
+    repository: https://example.com/ufw.git
+    main: [ main, master ]
+  libtap:
+    repository: https://example.com/libtap.git
+'''
+
+def writeFile(tmp_path, text = document):
+    fn = tmp_path / 'sources.yaml'
+    fn.write_text(text)
+    return str(fn)
+
+def expected(fn):
+    with open(fn) as fh:
+        data = yaml.safe_load(fh)
+    (data['root'], data['definition']) = os.path.split(os.path.realpath(fn))
+    return data
+
+def noParsing(monkeypatch):
+    def fail(text):
+        raise(AssertionError('parsed instead of using the cache'))
+    monkeypatch.setattr(mmh, 'parseText', fail)
+
+def testLoadUsesCache(tmp_path, monkeypatch):
+    fn = writeFile(tmp_path)
+    assert mmh.load(fn) == expected(fn)
+    assert os.path.isfile(mmh.yamlCacheFile(os.path.realpath(fn)))
+    noParsing(monkeypatch)
+    assert mmh.load(fn) == expected(fn)
+
+def testChangesInvalidate(tmp_path):
+    fn = writeFile(tmp_path)
+    mmh.load(fn)
+    writeFile(tmp_path, document + '  extra:\n    repository: x\n')
+    assert 'extra' in mmh.load(fn)['modules']
+
+def testSameSizeAndTime(tmp_path):
+    # Size and modification time are not enough: Edits within the time
+    # stamp's resolution keep both.
+    fn = writeFile(tmp_path)
+    st = os.stat(fn)
+    mmh.load(fn)
+    writeFile(tmp_path, document.replace('libtap', 'libtop'))
+    os.utime(fn, ns = (st.st_atime_ns, st.st_mtime_ns))
+    assert os.stat(fn).st_size == st.st_size
+    assert 'libtop' in mmh.load(fn)['modules']
+
+def testBrokenCacheIsReplaced(tmp_path):
+    fn = writeFile(tmp_path)
+    mmh.load(fn)
+    cache = mmh.yamlCacheFile(os.path.realpath(fn))
+    with open(cache, 'wb') as fh:
+        fh.write(b'garbage')
+    assert mmh.load(fn) == expected(fn)
+    with open(cache, 'rb') as fh:
+        assert fh.read() != b'garbage'
+
+def testLoadedDataIsPrivate(tmp_path):
+    fn = writeFile(tmp_path)
+    mmh.load(fn)['modules']['ufw']['main'].append('changed')
+    assert mmh.load(fn) == expected(fn)
+
+def testCacheDisabled(tmp_path, monkeypatch):
+    monkeypatch.setenv('MMH_YAML_CACHE', '0')
+    fn = writeFile(tmp_path)
+    assert mmh.load(fn) == expected(fn)
+    assert not os.path.exists(mmh.yamlCacheFile(os.path.realpath(fn)))
+
+def testUnwritableCache(tmp_path, monkeypatch):
+    # A cache directory, that cannot be created, does not stop loading.
+    blocker = tmp_path / 'blocker'
+    blocker.write_text('')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(blocker))
+    fn = writeFile(tmp_path)
+    assert mmh.load(fn) == expected(fn)
+    assert mmh.load(fn) == expected(fn)
+
+def testEmptyFile(tmp_path):
+    fn = writeFile(tmp_path, '')
+    assert mmh.load(fn) == { 'root': str(tmp_path.resolve()),
+                             'definition': 'sources.yaml' }
+    assert mmh.load(fn) == { 'root': str(tmp_path.resolve()),
+                             'definition': 'sources.yaml' }